@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 # Flask / utils
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
 from functools import wraps
 from datetime import datetime, timedelta
 import os
@@ -9,18 +9,33 @@ import logging
 import random
 import requests
 import time as pytime
+import click
 
 # Env / scheduler (se usar)
 from dotenv import load_dotenv
 from apscheduler.schedulers.background import BackgroundScheduler
 
 # Firebase Admin
-import firebase_admin
-from firebase_admin import credentials
 from firebase_admin import db as rtdb
 from firebase_admin import auth as fb_auth
 from firebase_admin import firestore
 
+from firebase_app import inicializar_firebase
+from redirecionamento import Redirecionador
+import indice_slugs
+import importacao_links
+from exclusao_logs import ExclusaoLogs
+from buscas_produtos import BuscasProdutos, ErroBusca
+from cota_api import CotaApi
+from recategorizacao import Recategorizacao
+import catalogo_produtos
+from vista_produtos import VistaProdutos
+from cliente_shopee import ClienteShopee, ErroShopee, credenciais, produto_de_no
+import rollups_cliques
+from consultas import contar, executar_em_paralelo, paginar
+from snapshot_painel import SnapshotsPainel
+from rankings_grupos import MotorGrupos, montar_grupo
+
 # ✅ Geração de descrições e benefícios (IA simplificada)
 def gerar_descricao(titulo):
     frases = [
@@ -131,22 +146,14 @@ def verificar_envio_agendado():
                         print("❌ Bot token ou grupo_id ausente. Pulando envio.")
                         continue
 
-                    termos_ref = db.collection("resultados_busca").document(uid).collection("termos").stream()
-                    produtos_salvos = []
-                    for doc in termos_ref:
-                        termo = doc.to_dict()
-                        produtos_salvos.extend(termo.get("produtos", []))
+                    catalogo_produtos.garantir_migrado(db, uid)
+                    produtos_salvos = catalogo_produtos.buscar_por_titulos(db, uid, produtos)
 
                     enviados = 0
                     for p in produtos_salvos:
                         if enviados >= mensagens_por_minuto:
                             break
 
-                        titulo_salvo = (p.get("titulo") or "").strip().lower()
-                        produtos_normalizados = [t.strip().lower() for t in produtos]
-                        if titulo_salvo not in produtos_normalizados:
-                            continue
-
                         logs_ref = db.collection("telegram_logs").document(uid).collection(bot_id)
                         enviados_recentemente = logs_ref.where("enviado_em", ">=", (agora - timedelta(hours=48)).isoformat())\
                             .where("titulo", "==", p.get("titulo", "")).stream()
@@ -221,18 +228,7 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "clickdivulga-default")
 
-firebase_b64 = os.getenv("FIREBASE_KEY_B64")
-if not firebase_b64:
-    raise ValueError("FIREBASE_KEY_B64 não configurado no .env")
-
-decoded = base64.b64decode(firebase_b64)
-with tempfile.NamedTemporaryFile(delete=False, suffix=".json") as temp_file:
-    temp_file.write(decoded)
-    temp_file.flush()
-    cred = credentials.Certificate(temp_file.name)
-    firebase_admin.initialize_app(cred)
-
-db = firestore.client()
+db = inicializar_firebase()
 
 # ✅ Agendador de envio automático (a cada minuto)
 scheduler = BackgroundScheduler(timezone="America/Sao_Paulo")
@@ -243,6 +239,44 @@ try:
 except Exception as e:
     print(f"❌ Erro ao iniciar o scheduler: {e}")
 
+# 🏆 Estatísticas de /grupos em memória (rankings top-k e recomendações por usuário)
+motor_grupos = MotorGrupos(db, ttl=float(os.getenv("GRUPOS_ESTADO_TTL", "60")))
+
+# 🛒 Cliente da API de afiliados da Shopee (conexões reaproveitadas entre as buscas)
+cliente_shopee = ClienteShopee.do_ambiente()
+# 🎟️ Cota diária da API por uid: verificada em memória, gravada com Increment pelo agendador
+cota_api = CotaApi.do_ambiente(db)
+# Páginas de 10 produtos pedidas (em paralelo) por busca de palavra-chave ou loja
+PAGINAS_BUSCA = int(os.getenv("SHOPEE_PAGINAS_BUSCA", "3"))
+# 🛍️ Vista materializada de /produtos por usuário (refeita quando o catálogo muda)
+vista_produtos = VistaProdutos(db)
+
+# 🔀 Redirecionamento (/r/<slug>): cache de slugs + fila de cliques, compartilhado com redirect_app.py
+redirecionador = Redirecionador(db, agregadores=[motor_grupos])
+redirecionador.registrar_rotas(app)
+cache_slugs = redirecionador.cache
+slugs_migrados = redirecionador.slugs_migrados
+buscar_link_legado = redirecionador.buscar_link_legado
+
+def buscar_link_id(uid, slug):
+    """Id do documento em links_encurtados para o slug do usuário (ou None)."""
+    link = indice_slugs.obter(db, slug)
+    if link:
+        return link["link_id"] if link.get("uid") == uid else None
+    if not slugs_migrados():
+        doc = buscar_link_legado(slug, uid)
+        return doc.id if doc else None
+    return None
+
+def parametros_paginacao():
+    """(cursor, direcao, tamanho) da query string de páginas com cursor."""
+    por_pagina = request.args.get("por_pagina", "20")
+    return (
+        request.args.get("cursor") or None,
+        request.args.get("dir", "proxima"),
+        int(por_pagina) if por_pagina.isdigit() else 20
+    )
+
 def verificar_login(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -251,26 +285,70 @@ def verificar_login(f):
         return f(*args, **kwargs)
     return decorated_function
 
-# 🔧 Atualiza categorias automaticamente com base no destino
-def atualizar_categoria_links(uid):
+# 🔧 Categoria do link derivada do destino (definida ao criar/editar o link)
+def categoria_por_url(url):
+    if "whatsapp" in url:
+        return "grupo"
+    if "shopee.com.br" in url:
+        return "produto"
+    return "outro"
+
+# 🔧 Categoria escolhida no formulário ("whatsapp" é o rótulo de grupo); sem escolha, derivada do destino.
+# Retorna (categoria, manual): categorias manuais não são alteradas pela recategorização.
+def categoria_do_link(tipo, url):
+    tipo = importacao_links.normalizar_tipo(tipo)
+    if tipo in importacao_links.TIPOS:
+        return tipo, True
+    return categoria_por_url(url), False
+
+# 🔧 Recategorização: faixas de ids em paralelo, batches e checkpoint por faixa
+recategorizacao = Recategorizacao(
+    db,
+    categoria_por_url,
+    ao_alterar=lambda slugs: cache_slugs.invalidar(*slugs),
+    particoes=int(os.getenv("CATEGORIAS_PARTICOES", "8"))
+)
+
+def reconciliar_categorias():
     try:
-        links = db.collection("links_encurtados") \
-            .where("uid", "==", uid).stream()
-        for doc in links:
-            dados = doc.to_dict()
-            url = dados.get("url_destino", "")
-            categoria_atual = dados.get("categoria", "")
-            nova_categoria = "outro"
-
-            if "whatsapp.com" in url:
-                nova_categoria = "grupo"
-            elif "shopee.com.br" in url:
-                nova_categoria = "produto"
-
-            if categoria_atual != nova_categoria:
-                doc.reference.update({"categoria": nova_categoria})
+        relatorio = recategorizacao.executar()
     except Exception as e:
-        print(f"Erro ao atualizar categorias automaticamente: {e}")
+        print(f"Erro ao reconciliar categorias: {e}")
+        return None
+    return relatorio
+
+# 🔧 flask --app app recategorizar-links (retoma o job se ele foi interrompido)
+@app.cli.command("recategorizar-links")
+def recategorizar_links():
+    """Recalcula a categoria de todos os links a partir da URL."""
+    relatorio = reconciliar_categorias()
+    if relatorio:
+        print(f"✅ {relatorio['alterados']} alterados de {relatorio['lidos']} ({relatorio['docs_por_segundo']} docs/s)")
+
+# 🔁 Migração: flask --app app migrar-slugs (pode ser interrompida e executada de novo)
+@app.cli.command("migrar-slugs")
+def migrar_slugs():
+    """Preenche slugs/{slug} para os links já existentes."""
+    resultado = indice_slugs.migrar(db)
+    redirecionador.marcar_slugs_migrados()
+    print(f"✅ Migração de slugs concluída: {resultado['migrados']} migrados, {resultado['conflitos']} conflitos")
+
+# 📦 flask --app app migrar-catalogo: move os produtos dos termos para o catálogo de todos os usuários
+@app.cli.command("migrar-catalogo")
+def migrar_catalogo():
+    """Migra os termos com array de produtos (os demais migram no primeiro acesso)."""
+    for ref in db.collection(catalogo_produtos.COLECAO_RESULTADOS).list_documents():
+        catalogo_produtos.garantir_migrado(db, ref.id)
+    print("✅ Migração do catálogo concluída")
+
+# 🔁 Backfill dos rollups: flask --app app reconstruir-rollups 30 [--uid UID]
+@app.cli.command("reconstruir-rollups")
+@click.argument("dias", default=30)
+@click.option("--uid", default=None, help="Reconstrói só os rollups deste usuário")
+def reconstruir_rollups(dias, uid):
+    """Recalcula rollups_cliques dos últimos DIAS a partir de logs_cliques."""
+    total = rollups_cliques.reconstruir(db, dias, uid)
+    print(f"✅ Rollups reconstruídos: {total} documentos de dia")
 
 @app.route("/forcar-envio", methods=["GET"])
 def forcar_envio():
@@ -308,19 +386,12 @@ def forcar_envio():
                     print("❌ Token ou Grupo ID ausente. Pulando...")
                     continue
 
-                termos_ref = db.collection("resultados_busca").document(uid).collection("termos").stream()
-                produtos_salvos = []
-                for doc in termos_ref:
-                    termo = doc.to_dict()
-                    lista = termo.get("produtos", [])
-                    produtos_salvos.extend(lista)
-                print(f"🛍️ Produtos salvos no Firestore: {len(produtos_salvos)}")
+                catalogo_produtos.garantir_migrado(db, uid)
+                produtos_salvos = catalogo_produtos.buscar_por_titulos(db, uid, produtos)
+                print(f"🛍️ Produtos selecionados no catálogo: {len(produtos_salvos)}")
 
                 enviados = 0
                 for p in produtos_salvos:
-                    if p.get("titulo") not in produtos:
-                        continue
-
                     titulo = p.get("titulo", "")
                     imagem = p.get("imagem") or p.get("image")
                     preco = p.get("preco", "0")
@@ -386,78 +457,81 @@ def logout():
     session.pop("usuario", None)
     return redirect(url_for("login"))
 
-@app.route("/painel")
-@verificar_login
-def painel():
-    uid = session["usuario"]["uid"]
-    print(f"📊 Carregando dashboard para UID: {uid}")
-
-    atualizar_categoria_links(uid)
-
-    # 🔹 LINKS GERADOS HOJE (usando timestamp real)
+# 📊 Recalcula os números do dashboard a partir das coleções de origem
+def calcular_painel(uid):
+    # 🔹 Consultas independentes disparadas em paralelo (latência ≈ a mais lenta)
     hoje = datetime.combine(datetime.today(), datetime.min.time())
-    links_hoje = db.collection("links_encurtados") \
-        .where("uid", "==", uid) \
-        .where("criado_em", ">=", hoje) \
-        .stream()
-    total_links_hoje = sum(1 for _ in links_hoje)
-
-    # 🔹 CLIQUES NO MÊS (limitado para evitar travamento)
-    inicio_mes = datetime.now().replace(day=1)
-    cliques_mes = sum(1 for _ in db.collection("logs_cliques")
+    mes_atual = datetime.now(rollups_cliques.FUSO).strftime("%Y-%m")
+
+    # 🔹 LINKS GERADOS HOJE (count() no servidor; criado_em é gravado em ISO)
+    def contar_links_hoje():
+        return contar(db.collection("links_encurtados")
                       .where("uid", "==", uid)
-                      .where("data", ">=", inicio_mes)
-                      .limit(5000)  # proteção de memória
-                      .stream())
+                      .where("criado_em", ">=", hoje.isoformat()))
 
-    # 🔹 PRODUTO MAIS CLICADO
-    try:
-        produtos = db.collection("links_encurtados") \
+    # 🔹 PRODUTO / GRUPO MAIS CLICADO
+    def mais_clicado(categoria):
+        docs = db.collection("links_encurtados") \
             .where("uid", "==", uid) \
-            .where("categoria", "==", "produto") \
+            .where("categoria", "==", categoria) \
             .order_by("cliques", direction=firestore.Query.DESCENDING) \
             .limit(1).stream()
-        produto_mais_clicado = next(produtos, None)
-        nome_produto = produto_mais_clicado.to_dict().get("titulo", "Sem nome") if produto_mais_clicado else "Nenhum"
-    except Exception as e:
-        print("Erro ao buscar produto mais clicado:", e)
-        nome_produto = "Nenhum"
+        doc = next(docs, None)
+        return doc.to_dict().get("titulo", "Sem nome") if doc else "Nenhum"
 
-    # 🔹 GRUPO MAIS CLICADO
-    try:
-        grupos = db.collection("links_encurtados") \
+    # 🔹 LINKS RECENTES
+    def buscar_links_recentes():
+        links_recentes = db.collection("links_encurtados") \
             .where("uid", "==", uid) \
-            .where("categoria", "==", "grupo") \
-            .order_by("cliques", direction=firestore.Query.DESCENDING) \
-            .limit(1).stream()
-        grupo_mais_clicado = next(grupos, None)
-        nome_grupo = grupo_mais_clicado.to_dict().get("titulo", "Sem nome") if grupo_mais_clicado else "Nenhum"
-    except Exception as e:
-        print("Erro ao buscar grupo mais clicado:", e)
-        nome_grupo = "Nenhum"
+            .order_by("criado_em", direction=firestore.Query.DESCENDING) \
+            .limit(4).stream()
+        links_formatados = []
+        for doc in links_recentes:
+            dados = doc.to_dict()
+            links_formatados.append({
+                "slug": dados.get("slug"),
+                "titulo": dados.get("titulo", "Sem título"),
+                "cliques": dados.get("cliques", 0),
+                "categoria": dados.get("categoria", "indefinido")
+            })
+        return links_formatados
+
+    falhas = set()
+    resultados = executar_em_paralelo({
+        "links_hoje": (contar_links_hoje, 0),
+        # 🔹 CLIQUES NO MÊS (sum() sobre os rollups diários)
+        "cliques_mes": (lambda: rollups_cliques.total_mes(db, uid, mes_atual), 0),
+        "produto_mais_clicado": (lambda: mais_clicado("produto"), "Nenhum"),
+        "grupo_mais_clicado": (lambda: mais_clicado("grupo"), "Nenhum"),
+        "links_recentes": (buscar_links_recentes, [])
+    }, timeout=float(os.getenv("PAINEL_TIMEOUT_CONSULTAS", "5")), falhas=falhas)
+
+    # Com alguma consulta no valor padrão o resultado é parcial e não vira snapshot
+    resultados["parcial"] = bool(falhas)
+    return resultados
+
+# 📊 Snapshot do dashboard por uid: atualizado pela fila de cliques e pelas rotas de links
+snapshots_painel = SnapshotsPainel(db, calcular_painel, ttl=float(os.getenv("PAINEL_SNAPSHOT_TTL", "30")))
+
+# 🗑️ Logs de links excluídos são apagados em lotes por jobs em segundo plano
+# O job espera o TTL do cache de slugs (+30s da fila): outros workers ainda servem o slug até lá
+exclusao_logs = ExclusaoLogs(db, ao_concluir=snapshots_painel.invalidar,
+                             atraso=float(os.getenv("CACHE_SLUGS_TTL", "60")) + 30)
 
-    # 🔹 LINKS RECENTES
-    links_recentes = db.collection("links_encurtados") \
-        .where("uid", "==", uid) \
-        .order_by("criado_em", direction=firestore.Query.DESCENDING) \
-        .limit(4).stream()
+@app.route("/painel")
+@verificar_login
+def painel():
+    uid = session["usuario"]["uid"]
+    print(f"📊 Carregando dashboard para UID: {uid}")
 
-    links_formatados = []
-    for doc in links_recentes:
-        dados = doc.to_dict()
-        links_formatados.append({
-            "slug": dados.get("slug"),
-            "titulo": dados.get("titulo", "Sem título"),
-            "cliques": dados.get("cliques", 0),
-            "categoria": dados.get("categoria", "indefinido")
-        })
+    snapshot = snapshots_painel.obter(uid)
 
     return render_template("dashboard_clickdivulga.html",
-        links_hoje=total_links_hoje,
-        cliques_mes=cliques_mes,
-        produto_mais_clicado=nome_produto,
-        grupo_mais_clicado=nome_grupo,
-        links_recentes=links_formatados
+        links_hoje=snapshot.get("links_hoje", 0),
+        cliques_mes=snapshot.get("cliques_mes", 0),
+        produto_mais_clicado=snapshot.get("produto_mais_clicado", "Nenhum"),
+        grupo_mais_clicado=snapshot.get("grupo_mais_clicado", "Nenhum"),
+        links_recentes=snapshot.get("links_recentes", [])
     )
 
 
@@ -470,35 +544,47 @@ def criar_link():
     if request.method == "POST":
         slug = request.form["slug"].strip()
         url_destino = request.form["url_destino"].strip()
-        tipo = request.form["tipo"]
         modo = request.form.get("modo", "direto")  # novo campo
+        categoria, categoria_manual = categoria_do_link(request.form.get("tipo"), url_destino)
 
-        existente = db.collection("links_encurtados").where("slug", "==", slug).get()
-        if existente:
+        if not indice_slugs.slug_valido(slug):
+            flash("Slug inválido: não pode ficar vazio nem conter '/'.", "error")
+            return redirect("/criar-link")
+
+        if not slugs_migrados() and buscar_link_legado(slug):
             flash("Esse slug já está em uso. Escolha outro.", "error")
             return redirect("/criar-link")
 
         dados = {
             "slug": slug,
             "url_destino": url_destino,
-            "categoria": tipo,
+            "categoria": categoria,
+            "categoria_manual": categoria_manual,
             "modo": modo,
             "uid": uid,
             "cliques": 0,
             "criado_em": datetime.now().isoformat()
         }
 
-        db.collection("links_encurtados").add(dados)
+        try:
+            indice_slugs.criar_link(db, dados)
+        except indice_slugs.SlugEmUso:
+            flash("Esse slug já está em uso. Escolha outro.", "error")
+            return redirect("/criar-link")
+
+        cache_slugs.invalidar(slug)
+        snapshots_painel.registrar_link_criado(uid, dados)
+        motor_grupos.invalidar(uid)
         flash("Link criado com sucesso!", "success")
         return redirect("/criar-link")
 
     links_ref = db.collection("links_encurtados").where("uid", "==", uid).order_by("criado_em", direction=firestore.Query.DESCENDING)
-    links_docs = links_ref.stream()
+    cursor, direcao, por_pagina = parametros_paginacao()
+    pagina = paginar(links_ref, db.collection("links_encurtados"), por_pagina, cursor, direcao)
 
     links = []
-    for doc in links_docs:
+    for doc in pagina["docs"]:
         dados = doc.to_dict()
-        dados["id"] = doc.id
         links.append({
             "id": doc.id,
             "slug": dados.get("slug"),
@@ -507,7 +593,54 @@ def criar_link():
             "modo": dados.get("modo", "direto")
         })
 
-    return render_template("criar_link_clickdivulga.html", links=links)
+    return render_template("criar_link_clickdivulga.html", links=links, paginacao=pagina)
+
+# 📥 Importação de links em massa: arquivo CSV/JSON (campo "arquivo") ou JSON no corpo
+IMPORTACAO_MAX_LINHAS = int(os.getenv("IMPORTACAO_MAX_LINHAS", "10000"))
+
+@app.route("/importar-links", methods=["POST"])
+@verificar_login
+def importar_links():
+    uid = session["usuario"]["uid"]
+
+    arquivo = request.files.get("arquivo")
+    try:
+        if arquivo:
+            formato = "json" if arquivo.filename.lower().endswith(".json") else "csv"
+            linhas = importacao_links.ler_linhas(arquivo.read().decode("utf-8"), formato)
+        elif request.is_json:
+            linhas = importacao_links.ler_linhas(request.get_data(as_text=True), "json")
+        else:
+            linhas = importacao_links.ler_linhas(request.get_data(as_text=True), "csv")
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({"erro": f"Arquivo inválido: {e}"}), 400
+
+    if len(linhas) > IMPORTACAO_MAX_LINHAS:
+        return jsonify({"erro": f"Máximo de {IMPORTACAO_MAX_LINHAS} links por importação"}), 400
+
+    relatorio = importacao_links.importar(
+        db, uid, linhas, categoria_por_url, verificar_legado=not slugs_migrados()
+    )
+
+    criados = relatorio["criados"]
+    desconhecidos = [r["slug"] for r in relatorio["resultados"] if r["status"] == "desconhecido"]
+    if desconhecidos:
+        cache_slugs.invalidar(*desconhecidos)
+        snapshots_painel.invalidar(uid)
+    if criados:
+        cache_slugs.invalidar(*[l["slug"] for l in criados])
+        snapshots_painel.registrar_link_criado(uid, criados[-1], quantidade=len(criados))
+        motor_grupos.invalidar(uid)
+
+    print(f"📥 Importação de {uid}: {len(criados)} criados, {relatorio['erros']} erros, "
+          f"{relatorio['desconhecidos']} sem confirmação")
+    return jsonify({
+        "total": len(linhas),
+        "criados": len(criados),
+        "erros": relatorio["erros"],
+        "desconhecidos": relatorio["desconhecidos"],
+        "resultados": relatorio["resultados"]
+    })
 
 @app.route("/excluir-link/<id>")
 @verificar_login
@@ -521,23 +654,41 @@ def excluir_link(id):
         dados = doc.to_dict()
         slug = dados.get("slug")
 
-        # 1. Exclui o link
-        doc_ref.delete()
-
-        # 2. Exclui todos os logs de cliques com o mesmo slug e uid
-        logs = db.collection("logs_cliques") \
-            .where("slug", "==", slug) \
-            .where("uid", "==", uid) \
-            .stream()
-        for log in logs:
-            log.reference.delete()
-
-        flash(f"Link e cliques do grupo '{slug}' excluídos com sucesso!", "success")
+        # 1. Exclui o link e libera o slug
+        batch = db.batch()
+        batch.delete(doc_ref)
+        if (indice_slugs.obter(db, slug) or {}).get("link_id") == id:
+            indice_slugs.remover(batch, db, slug)
+        batch.commit()
+        cache_slugs.invalidar(slug)
+        snapshots_painel.invalidar(uid)
+        motor_grupos.invalidar(uid)
+
+        # O cache deste worker é limpo agora; os outros workers (e o redirect_app) ainda podem
+        # redirecionar o slug até o TTL do cache (CACHE_SLUGS_TTL) expirar.
+        # 2. Os logs de cliques do link são apagados em segundo plano, depois desse TTL
+        #    (acompanhe em /excluir-link/status/<id>)
+        exclusao_logs.agendar(id, uid, slug)
+
+        flash(f"Link '{slug}' excluído! Os cliques registrados estão sendo apagados em segundo plano.", "success")
     else:
         flash("Ação não autorizada ou link inexistente.", "error")
 
     return redirect("/criar-link")
 
+@app.route("/excluir-link/status/<id>")
+@verificar_login
+def status_exclusao_link(id):
+    job = exclusao_logs.status(id)
+    if not job or job.get("uid") != session["usuario"]["uid"]:
+        return jsonify({"erro": "Exclusão não encontrada"}), 404
+    return jsonify({
+        "status": job.get("status"),
+        "slug": job.get("slug"),
+        "excluidos": job.get("excluidos", 0),
+        "erro": job.get("erro")
+    })
+
 @app.route("/editar-link/<id>", methods=["GET", "POST"])
 @verificar_login
 def editar_link(id):
@@ -552,15 +703,37 @@ def editar_link(id):
     if request.method == "POST":
         slug = request.form["slug"].strip()
         url_destino = request.form["url_destino"].strip()
-        tipo = request.form["tipo"]
         modo = request.form.get("modo", "direto")  # NOVO CAMPO
+        categoria, categoria_manual = categoria_do_link(request.form.get("tipo"), url_destino)
+
+        if not indice_slugs.slug_valido(slug):
+            flash("Slug inválido: não pode ficar vazio nem conter '/'.", "error")
+            return redirect(f"/editar-link/{id}")
 
-        doc_ref.update({
+        slug_antigo = doc.to_dict().get("slug")
+        if slug != slug_antigo and not slugs_migrados():
+            existente = buscar_link_legado(slug)
+            if existente and existente.id != id:
+                flash("Esse slug já está em uso. Escolha outro.", "error")
+                return redirect(f"/editar-link/{id}")
+
+        try:
+            indice_slugs.atualizar_link(db, id, slug_antigo, {
+                "slug": slug,
+                "url_destino": url_destino,
+                "categoria": categoria,
+                "categoria_manual": categoria_manual,
+                "modo": modo  # SALVANDO O MODO
+            })
+        except indice_slugs.SlugEmUso:
+            flash("Esse slug já está em uso. Escolha outro.", "error")
+            return redirect(f"/editar-link/{id}")
+        cache_slugs.invalidar(slug_antigo, slug)
+        snapshots_painel.registrar_link_editado(uid, slug_antigo, {
             "slug": slug,
-            "url_destino": url_destino,
-            "categoria": tipo,
-            "modo": modo  # SALVANDO O MODO
+            "categoria": categoria
         })
+        motor_grupos.invalidar(uid)
 
         flash("Link atualizado com sucesso!", "success")
         return redirect("/criar-link")
@@ -572,83 +745,29 @@ def editar_link(id):
         "slug": dados.get("slug"),
         "url_destino": dados.get("url_destino"),
         "categoria": dados.get("categoria"),
+        "categoria_manual": dados.get("categoria_manual", False),
         "modo": dados.get("modo", "direto")  # Para renderizar corretamente o radio
     })
 
-@app.route("/r/<slug>")
-def redirecionar(slug):
-    doc_ref = db.collection("links_encurtados").where("slug", "==", slug).limit(1).stream()
-    doc = next(doc_ref, None)
-
-    if doc:
-        dados = doc.to_dict()
-        modo = dados.get("modo", "direto")
-        categoria = dados.get("categoria", "")
-        destino = dados.get("url_destino", "/")
-
-        doc.reference.update({
-            "cliques": firestore.Increment(1)
-        })
-
-        db.collection("logs_cliques").add({
-            "slug": slug,
-            "uid": dados.get("uid", ""),
-            "categoria": categoria,
-            "data": datetime.now(),
-            "ip": request.remote_addr,
-            "user_agent": request.headers.get("User-Agent")
-        })
-
-        if categoria == "contador":
-            return render_template("contador_clicks.html", slug=slug)
-
-        if modo == "camuflado":
-            return render_template("intermediario.html", link_grupo=destino, slug=slug)
-
-        return redirect(destino)
-
-    return "Link não encontrado", 404
-
-# ✅ ROTA PARA REGISTRAR CLIQUES REAIS (botão da página camuflada)
-@app.route("/registrar-clique-grupo/<slug>")
-def registrar_clique_grupo(slug):
-    doc_ref = db.collection("links_encurtados").where("slug", "==", slug).limit(1).stream()
-    doc = next(doc_ref, None)
-    if not doc:
-        return "Link não encontrado", 404
-
-    dados = doc.to_dict()
-    db.collection("logs_cliques").add({
-        "slug": slug,
-        "uid": dados.get("uid", ""),
-        "categoria": dados.get("categoria", ""),
-        "data": datetime.now(),
-        "ip": request.remote_addr,
-        "user_agent": request.headers.get("User-Agent"),
-        "tipo": "botao_grupo"
-    })
-
-    doc.reference.update({"cliques": firestore.Increment(1)})
-    return "", 204
+# 📈 Métricas internas do worker (cache de slugs etc.)
+@app.route("/metricas")
+@verificar_login
+def metricas():
+    return jsonify({**redirecionador.estatisticas(), "shopee": cliente_shopee.estatisticas(),
+                    "cota_api": cota_api.estatisticas()})
 
 @app.route("/grupos", methods=["GET", "POST"])
 @verificar_login
 def grupos():
-    from pytz import timezone
-
     uid = session["usuario"]["uid"]
-    br_tz = timezone("America/Sao_Paulo")
 
     if request.method == "POST":
         slug = request.form["slug"]
         entradas = int(request.form.get("entradas", 0))
-        doc_ref = db.collection("links_encurtados") \
-            .where("uid", "==", uid) \
-            .where("slug", "==", slug) \
-            .limit(1).stream()
-        doc = next(doc_ref, None)
-        if doc:
-            doc.reference.update({"entradas": entradas})
+        link_id = buscar_link_id(uid, slug)
+        if link_id:
+            db.collection("links_encurtados").document(link_id).update({"entradas": entradas})
+            motor_grupos.registrar_entradas(uid, slug, entradas)
         return redirect("/grupos")
 
     # Filtros
@@ -657,106 +776,49 @@ def grupos():
     dias = int(filtro_data) if filtro_data.isdigit() else None
     data_limite = datetime.now() - timedelta(days=dias) if dias else None
 
-    # Coleta dos grupos filtrados
+    # Resumo, rankings e recomendações vêm do estado pré-calculado do usuário
+    dados = motor_grupos.painel(uid, filtro_tipo, data_limite)
+
+    # Tabela paginada por cursor (criado_em desc)
     grupos_query = db.collection("links_encurtados").where("uid", "==", uid)
     if filtro_tipo != "todos":
         grupos_query = grupos_query.where("categoria", "==", filtro_tipo)
-    grupos_ref = grupos_query.stream()
-
-    grupos, comparativo_labels, comparativo_data = [], [], []
-    total_cliques = 0
-
-    for doc in grupos_ref:
-        dados = doc.to_dict()
-        slug = dados.get("slug")
-        criado_em = dados.get("criado_em", "")
-        try:
-            dt_criado = datetime.fromisoformat(criado_em.replace("Z", "")) if isinstance(criado_em, str) else criado_em
-            if data_limite and dt_criado < data_limite:
-                continue
-        except:
-            continue
-
-        cliques = int(dados.get("cliques", 0))
-        entradas = int(dados.get("entradas", 0))
-        conversao = round((entradas / cliques) * 100, 2) if cliques > 0 else 0
-
-        # Etiquetas visuais
-        etiquetas = []
-        if conversao >= 70:
-            etiquetas.append("🟢 Alta Conversão")
-        if cliques < 10:
-            etiquetas.append("🟡 Baixo Tráfego")
-        if entradas == 0:
-            etiquetas.append("🔴 Sem Entrada")
-
-        grupos.append({
-            "slug": slug,
-            "cliques": cliques,
-            "entradas": entradas,
-            "conversao": conversao,
-            "etiquetas": etiquetas
-        })
-
-        comparativo_labels.append(slug)
-        comparativo_data.append(cliques)
-        total_cliques += cliques
-        
-    # Resumo
-    total_grupos = len(grupos)
-    media_cliques = round(total_cliques / total_grupos, 2) if total_grupos else 0
-    mais_clicado = max(grupos, key=lambda g: g["cliques"])["slug"] if grupos else "Nenhum"
-
-    resumo = {
-        "total_cliques": total_cliques,
-        "total_grupos": total_grupos,
-        "media_cliques": media_cliques,
-        "mais_clicado": mais_clicado
-    }
-
-    # Cliques por hora (gráfico) com timezone BR
-    cliques_por_hora = [0] * 24
-    logs = db.collection("logs_cliques").where("uid", "==", uid).stream()
-    for doc in logs:
-        dados = doc.to_dict()
-        data = dados.get("data")
-        try:
-            dt = datetime.fromisoformat(data.replace("Z", "")) if isinstance(data, str) else data
-            dt = dt.astimezone(br_tz)
-            if data_limite and dt < data_limite:
-                continue
-            cliques_por_hora[dt.hour] += 1
-        except Exception as e:
-            print(f"[ERRO HORA BR] {e}")
-            continue
-
-    # Rankings
-    ranking_cliques = sorted(grupos, key=lambda g: g["cliques"], reverse=True)[:5]
-    ranking_conversao = sorted(grupos, key=lambda g: g["conversao"], reverse=True)[:5]
-    ranking_entradas = sorted(grupos, key=lambda g: g["entradas"], reverse=True)[:5]
-
-    # Recomendações inteligentes
-    recomendacoes = []
-    for g in grupos:
-        if g["conversao"] >= 80 and g["cliques"] >= 30:
-            recomendacoes.append(f"🔥 O grupo *{g['slug']}* está com alta conversão ({g['conversao']}%)")
-        if g["cliques"] >= 50 and g["entradas"] == 0:
-            recomendacoes.append(f"⚠️ O grupo *{g['slug']}* teve muitos cliques mas nenhuma entrada.")
-        if g["cliques"] <= 5:
-            recomendacoes.append(f"📉 O grupo *{g['slug']}* teve poucos cliques. Avalie sua divulgação.")
+    if data_limite:
+        grupos_query = grupos_query.where("criado_em", ">=", data_limite.isoformat())
+    grupos_query = grupos_query.order_by("criado_em", direction=firestore.Query.DESCENDING)
+    cursor, direcao, por_pagina = parametros_paginacao()
+    pagina = paginar(grupos_query, db.collection("links_encurtados"), por_pagina, cursor, direcao)
+
+    grupos = []
+    for doc in pagina["docs"]:
+        link = doc.to_dict()
+        if link.get("slug"):
+            grupos.append(montar_grupo(
+                link["slug"], int(link.get("cliques", 0)), int(link.get("entradas", 0)), link.get("criado_em")
+            ))
+    comparativo_labels = [g["slug"] for g in grupos]
+    comparativo_data = [g["cliques"] for g in grupos]
+
+    # Cliques por hora (gráfico) com timezone BR, a partir dos rollups diários
+    try:
+        cliques_por_hora = rollups_cliques.cliques_por_hora(db, uid, data_limite)
+    except Exception as e:
+        print(f"[ERRO HORA BR] {e}")
+        cliques_por_hora = [0] * 24
 
     return render_template("desempenho_de_grupos.html",
         grupos=grupos,
         filtro=filtro_data,
         tipo=filtro_tipo,
-        resumo=resumo,
+        resumo=dados["resumo"],
         cliques=cliques_por_hora,
-        ranking_cliques=ranking_cliques,
-        ranking_conversao=ranking_conversao,
-        ranking_entradas=ranking_entradas,
+        ranking_cliques=dados["ranking_cliques"],
+        ranking_conversao=dados["ranking_conversao"],
+        ranking_entradas=dados["ranking_entradas"],
         comparativo_labels=comparativo_labels,
         comparativo_data=comparativo_data,
-        recomendacoes=recomendacoes
+        recomendacoes=dados["recomendacoes"],
+        paginacao=pagina
     )
 
 
@@ -768,14 +830,10 @@ def atualizar_entradas():
     uid = session["usuario"]["uid"]
 
     try:
-        ref = db.collection("links_encurtados") \
-            .where("uid", "==", uid) \
-            .where("slug", "==", slug) \
-            .limit(1).stream()
-
-        doc = next(ref, None)
-        if doc:
-            doc.reference.update({"entradas": entradas})
+        link_id = buscar_link_id(uid, slug)
+        if link_id:
+            db.collection("links_encurtados").document(link_id).update({"entradas": entradas})
+            motor_grupos.registrar_entradas(uid, slug, entradas)
             flash("Entradas atualizadas com sucesso!", "success")
         else:
             flash("Link não encontrado.", "error")
@@ -788,273 +846,171 @@ def atualizar_entradas():
 
 @app.route("/atualizar-categorias")
 def atualizar_categorias_links():
-    try:
-        links = db.collection("links_encurtados").stream()
-        atualizados = 0
-
-        for doc in links:
-            dados = doc.to_dict()
-            url = dados.get("url_destino", "")
-            categoria = dados.get("categoria", "")
-
-            nova_categoria = "outro"
-            if "whatsapp" in url:
-                nova_categoria = "grupo"
-            elif "shopee.com.br" in url:
-                nova_categoria = "produto"
-
-            if categoria != nova_categoria:
-                doc.reference.update({"categoria": nova_categoria})
-                atualizados += 1
-
-        return f"✅ Categorias atualizadas com sucesso. Total alterados: {atualizados}"
-    
-    except Exception as e:
-        return f"❌ Erro ao atualizar categorias: {e}"
+    # Roda em segundo plano; chamadas seguintes mostram o progresso
+    estado = recategorizacao.iniciar_em_segundo_plano()
+    particoes = estado.get("particoes", {})
+    return jsonify({
+        "status": estado.get("status"),
+        "lidos": sum(p.get("lidos", 0) for p in particoes.values()),
+        "alterados": sum(p.get("alterados", 0) for p in particoes.values()),
+        "faixas_concluidas": sum(1 for p in particoes.values() if p.get("concluida")),
+        "faixas": len(particoes),
+        "docs_por_segundo": estado.get("docs_por_segundo")
+    })
 
 @app.route("/produtos")
 @verificar_login
 def produtos():
-    from pytz import timezone
-    from datetime import datetime
-
     uid = session["usuario"]["uid"]
-    firestore_client = firestore.client()
 
     produtos = []  # Produtos encontrados (não salvos)
-    resultados = []
-    lojas_disponiveis = set()
-    palavras_disponiveis = set()
-    todos_produtos = []
-
+    # Vista materializada: produtos ordenados (máx. 400), datas formatadas, lojas e palavras
     try:
-        termos_ref = firestore_client.collection("resultados_busca").document(uid).collection("termos").stream()
-        for doc in termos_ref:
-            dados = doc.to_dict()
-            atualizado_em = dados.get("atualizado_em")
-
-            for p in dados.get("produtos", []):
-                if p.get("loja"):
-                    lojas_disponiveis.add(p.get("loja"))
-                if dados.get("termo"):
-                    palavras_disponiveis.add(dados.get("termo").lower())
-
-                p["atualizado_em"] = atualizado_em
-                todos_produtos.append(p)
-
-            resultados.append({
-                "termo": dados.get("termo"),
-                "tipo": dados.get("tipo"),
-                "atualizado_em": atualizado_em,
-                "produtos": dados.get("produtos", [])
-            })
+        vista = vista_produtos.obter(uid)
     except Exception as e:
         print(f"Erro ao carregar resultados salvos: {e}")
+        vista = {"produtos": [], "resultados": [], "lojas_unicas": [], "palavras_disponiveis": []}
 
-    # Limita a 400 produtos por afiliado (mantém os mais recentes)
-    todos_produtos = sorted(todos_produtos, key=lambda x: x.get("atualizado_em", ""), reverse=True)[:400]
-
+    # Filtro pelo índice invertido da vista: todas as palavras, como prefixo e sem acento
     filtro_loja = request.args.get("filtro_loja", "").strip()
-    filtro_termo = request.args.get("filtro_termo", "").strip().lower()
+    filtro_termo = request.args.get("filtro_termo", "").strip()
+    produtos_ordenados = VistaProdutos.filtrar(vista, filtro_loja, filtro_termo) if vista["produtos"] else []
 
-    produtos_filtrados = []
-    for p in todos_produtos:
-        if filtro_loja and p.get("loja") != filtro_loja:
-            continue
-        if filtro_termo and filtro_termo not in p.get("titulo", "").lower():
-            continue
-        produtos_filtrados.append(p)
-
-    produtos_ordenados = sorted(produtos_filtrados, key=lambda x: x.get("atualizado_em", ""), reverse=True)
-
-    pagina = int(request.args.get("pagina", 1))
+    pagina = request.args.get("pagina", "1")
+    pagina = max(1, int(pagina)) if pagina.isdigit() else 1
     inicio = (pagina - 1) * 20
     fim = inicio + 20
-    total_paginas = (len(produtos_ordenados) // 20) + (1 if len(produtos_ordenados) % 20 > 0 else 0)
-
-    for p in produtos_ordenados:
-        try:
-            if p.get("atualizado_em"):
-                dt = datetime.fromisoformat(p["atualizado_em"].replace("Z", "+00:00"))
-                p["atualizado_em"] = dt.astimezone(timezone("America/Sao_Paulo")).strftime("%Y/%m/%d às %H:%M")
-        except:
-            p["atualizado_em"] = "Data inválida"
+    total_paginas = (len(produtos_ordenados) + 19) // 20
 
     return render_template("produtos_clickdivulga.html",
         produtos=produtos,
-        resultados=resultados,
+        resultados=vista["resultados"],
         produtos_ordenados=produtos_ordenados,
-        lojas_unicas=sorted(lojas_disponiveis),
-        palavras_disponiveis=sorted(palavras_disponiveis),
+        lojas_unicas=vista["lojas_unicas"],
+        palavras_disponiveis=vista["palavras_disponiveis"],
         pagina=pagina,
         inicio=inicio,
         fim=fim,
-        total_paginas=total_paginas
+        total_paginas=total_paginas,
+        busca_id=request.args.get("busca")
     )
 
-@app.route("/buscar-produto", methods=["POST"])
-@verificar_login
-def buscar_produto():
-    import re, time, hashlib, requests, json
+def _executar_busca(job: dict) -> dict:
+    """Corpo de um job de busca (produto ou loja): roda no executor de buscas_produtos."""
     from datetime import datetime
 
-    uid = session["usuario"]["uid"]
-    keyword = request.form.get("keyword", "").strip()
-    url = request.form.get("url", "").strip()
-    category_id = request.form.get("categoria") or ""
-    entrada = url if url else keyword
-    match = re.search(r"-i\.(\d+)\.(\d+)", entrada)
-    usar_palavra_chave = not match
+    uid, tipo, termo, termo_id = job["uid"], job["tipo"], job["termo"], job["termo_id"]
+    parametros = job.get("parametros") or {}
+    filtros = job.get("filtros") or {}
 
-    termo_final = keyword if usar_palavra_chave else entrada
-    termo_id = termo_final.lower().replace(" ", "-").replace(".", "").replace("/", "")
-
-    termo_doc = db.collection("resultados_busca").document(uid).collection("termos").document(termo_id).get()
+    termo_doc = catalogo_produtos.termos_ref(db, uid).document(termo_id).get()
     if termo_doc.exists:
         dados = termo_doc.to_dict()
         atualizado_em = dados.get("atualizado_em")
         if atualizado_em:
             dt = datetime.fromisoformat(atualizado_em)
             if (datetime.now() - dt).total_seconds() < 43200:
-                flash("⚠️ Você já buscou esse termo nas últimas 12 horas.", "warning")
-                return redirect("/produtos")
-
-    hoje = datetime.now().date().isoformat()
-    contador_ref = db.collection("api_contador").document(uid)
-    contador_doc = contador_ref.get()
-    contador = contador_doc.to_dict() if contador_doc.exists else {}
-
-    if contador.get("data") != hoje:
-        contador = {"data": hoje, "uso_afiliado": 0, "uso_base": 0}
-    if contador["uso_afiliado"] >= 25000:
-        flash("🚫 Limite de uso diário atingido para hoje (25.000 requisições).", "error")
-        return redirect("/produtos")
+                if tipo == "loja":
+                    raise ErroBusca("⚠️ Essa loja já foi buscada nas últimas 12 horas.", "warning")
+                raise ErroBusca("⚠️ Você já buscou esse termo nas últimas 12 horas.", "warning")
 
     doc = db.collection("api_shopee").document(uid).get()
     if not doc.exists:
-        flash("⚠️ Cadastre sua API Shopee antes de buscar produtos.", "error")
-        return redirect("/minha-api")
+        raise ErroBusca("⚠️ Cadastre sua API Shopee antes de buscar.", redirecionar="/minha-api")
 
-    cred = doc.to_dict()
-    app_id = cred.get("app_id") or cred.get("client_id")
-    app_secret = cred.get("app_secret") or cred.get("client_secret")
+    app_id, app_secret = credenciais(doc.to_dict())
     if not app_id or not app_secret:
-        flash("❌ App ID ou Secret não encontrados.", "error")
-        return redirect("/minha-api")
+        raise ErroBusca("❌ App ID ou Secret não encontrados.", redirecionar="/minha-api")
 
-    if usar_palavra_chave:
-        if not keyword:
-            flash("❌ Digite uma palavra-chave ou link válido.", "error")
-            return redirect("/produtos")
-        category_param = f'productCatId: {category_id},' if category_id else ''
-        query_dict = {
-            "query": f"""
-            query {{
-              productOfferV2(keyword: \"{keyword}\", {category_param} sortType: 2, page: 1, limit: 10) {{
-                nodes {{
-                  productName
-                  imageUrl
-                  priceMin
-                  commissionRate
-                  shopName
-                  productLink
-                  offerLink
-                }}
-              }}
-            }}
-            """
-        }
-    else:
-        shop_id, item_id = match.groups()
-        query_dict = {
-            "query": f"""
-            query {{
-              productOfferV2(shopId: {shop_id}, itemId: {item_id}, page: 1, limit: 1) {{
-                nodes {{
-                  productName
-                  imageUrl
-                  priceMin
-                  commissionRate
-                  shopName
-                  productLink
-                  offerLink
-                }}
-              }}
-            }}
-            """
-        }
-
-    payload_str = json.dumps(query_dict, separators=(',', ':'))
-    timestamp = str(int(time.time()) + 20)
-    base_string = app_id + timestamp + payload_str + app_secret
-    signature = hashlib.sha256(base_string.encode()).hexdigest()
-    headers = {
-        "Authorization": f"SHA256 Credential={app_id}, Signature={signature}, Timestamp={timestamp}",
-        "Content-Type": "application/json"
-    }
+    # Fichas da cota diária: uma por página (link direto de produto: uma página com o item)
+    paginas = cota_api.reservar(uid, "afiliado", 1 if parametros.get("item_id") else PAGINAS_BUSCA)
+    if not paginas:
+        raise ErroBusca("🚫 Limite de uso diário atingido para hoje.")
 
     try:
-        response = requests.post("https://open-api.affiliate.shopee.com.br/graphql", headers=headers, data=payload_str)
-        if response.status_code == 200:
-            nodes = response.json().get("data", {}).get("productOfferV2", {}).get("nodes", [])
-            produtos = []
-            for p in nodes:
-                preco = float(p.get("priceMin", 0))
-                taxa_total = float(p.get("commissionRate") or 0) * 100
-                taxa_loja = max(taxa_total - 3, 0)
-                comissao_live = round(preco * ((10 + taxa_loja) / 100), 2)
-                comissao_redes = round(preco * ((3 + taxa_loja) / 100), 2)
-                produtos.append({
-                    "titulo": p.get("productName"),
-                    "imagem": p.get("imageUrl"),
-                    "preco": preco,
-                    "comissao": taxa_loja,
-                    "comissao_live": comissao_live,
-                    "comissao_redes": comissao_redes,
-                    "loja": p.get("shopName"),
-                    "link": p.get("offerLink") or p.get("productLink")
-                })
-
-            # 🔁 Verifica e remove excesso
-            termos_ref = db.collection("resultados_busca").document(uid).collection("termos").stream()
-            todos_termos = sorted([d for d in termos_ref], key=lambda x: x.to_dict().get("atualizado_em"))
-            total_produtos = sum(len(d.to_dict().get("produtos", [])) for d in todos_termos)
-            while total_produtos + len(produtos) > 400 and todos_termos:
-                mais_antigo = todos_termos.pop(0)
-                qtd = len(mais_antigo.to_dict().get("produtos", []))
-                mais_antigo.reference.delete()
-                total_produtos -= qtd
-
-            db.collection("buscas").document(uid).collection("registros").add({
-                "tipo": "produto",
-                "termo": termo_final,
-                "data": datetime.now().isoformat()
-            })
-            db.collection("resultados_busca").document(uid).collection("termos").document(termo_id).set({
-                "tipo": "produto",
-                "termo": termo_final,
-                "atualizado_em": datetime.now().isoformat(),
-                "produtos": produtos
-            })
+        nodes, chamadas = cliente_shopee.buscar_paginas(app_id, app_secret, paginas, **parametros)
+    except ErroShopee as e:
+        # A primeira página falhou: as outras nem foram pedidas, só ela conta
+        cota_api.devolver(uid, "afiliado", paginas - 1)
+        print(f"❌ Erro ao buscar {tipo} na Shopee: {e}")
+        raise ErroBusca("❌ Erro ao buscar loja." if tipo == "loja" else "❌ Erro ao buscar produto na Shopee")
+    # Páginas vindas do cache de buscas não contam na cota
+    cota_api.devolver(uid, "afiliado", paginas - chamadas)
+
+    produtos = []
+    preco_min, preco_max = filtros.get("preco_min"), filtros.get("preco_max")
+    min_val = float(preco_min.replace(",", ".")) if preco_min else 0
+    max_val = float(preco_max.replace(",", ".")) if preco_max else float("inf")
+    for p in nodes:
+        produto = produto_de_no(p)
+        if min_val <= produto["preco"] <= max_val:
+            produtos.append(produto)
+
+    # 🧹 Limita total de produtos salvos por afiliado (max: 400)
+    catalogo_produtos.garantir_migrado(db, uid)
+    catalogo_produtos.aplicar_limite(db, uid, len(produtos), ignorar=termo_id)
+
+    db.collection("buscas").document(uid).collection("registros").add({
+        "tipo": tipo,
+        "termo": termo,
+        "data": datetime.now().isoformat()
+    })
+    catalogo_produtos.gravar_termo(db, uid, termo_id, tipo, termo, produtos)
 
-            contador["uso_afiliado"] += 1
-            db.collection("api_contador").document(uid).set(contador)
+    return {"mensagem": f"✅ {len(produtos)} produtos encontrados para '{termo}'.", "quantidade": len(produtos)}
 
-            return redirect("/produtos")
+# 🔎 Buscas rodam em segundo plano; o request só agenda o job e volta para /produtos
+buscas_produtos = BuscasProdutos.do_ambiente(db, _executar_busca)
 
-        flash("❌ Erro ao buscar produto na Shopee", "error")
+def _agendar_busca(uid: str, tipo: str, termo: str, parametros: dict, filtros: dict | None = None):
+    termo_id = termo.lower().replace(" ", "-").replace(".", "").replace("/", "")
+    try:
+        job_id, novo = buscas_produtos.agendar(uid, tipo, termo, termo_id, parametros, filtros)
+    except ErroBusca as e:
+        flash(e.mensagem, e.nivel)
         return redirect("/produtos")
-
     except Exception as e:
-        print("❌ Erro:", e)
+        print("❌ Erro ao agendar busca:", e)
         flash(f"Erro inesperado: {e}", "error")
         return redirect("/produtos")
+    if not novo:
+        flash("⏳ Essa busca já está em andamento.", "warning")
+    return redirect(url_for("produtos", busca=job_id))
+
+@app.route("/buscar-produto", methods=["POST"])
+@verificar_login
+def buscar_produto():
+    import re
+
+    uid = session["usuario"]["uid"]
+    keyword = request.form.get("keyword", "").strip()
+    url = request.form.get("url", "").strip()
+    category_id = request.form.get("categoria") or ""
+    entrada = url if url else keyword
+    match = re.search(r"-i\.(\d+)\.(\d+)", entrada)
+    usar_palavra_chave = not match
+
+    if usar_palavra_chave and not keyword:
+        flash("❌ Digite uma palavra-chave ou link válido.", "error")
+        return redirect("/produtos")
+
+    if category_id and not category_id.isdigit():
+        flash("❌ Categoria inválida.", "error")
+        return redirect("/produtos")
+
+    if usar_palavra_chave:
+        parametros = {"keyword": keyword, "categoria": category_id or None}
+    else:
+        shop_id, item_id = match.groups()
+        parametros = {"shop_id": shop_id, "item_id": item_id, "limite": 1}
+
+    termo_final = keyword if usar_palavra_chave else entrada
+    return _agendar_busca(uid, "produto", termo_final, parametros)
 
 @app.route("/buscar-loja", methods=["POST"])
 @verificar_login
 def buscar_loja():
-    import re, time, hashlib, requests, json
-    from datetime import datetime
+    import re
 
     uid = session["usuario"]["uid"]
     loja_input = request.form.get("loja", "").strip()
@@ -1071,131 +1027,35 @@ def buscar_loja():
         flash("⚠️ Link da loja inválido.", "error")
         return redirect("/produtos")
 
-    termo_id = loja_input.lower().replace(" ", "-").replace(".", "").replace("/", "")
-
-    termo_doc = db.collection("resultados_busca").document(uid).collection("termos").document(termo_id).get()
-    if termo_doc.exists:
-        dados = termo_doc.to_dict()
-        atualizado_em = dados.get("atualizado_em")
-        if atualizado_em:
-            dt = datetime.fromisoformat(atualizado_em)
-            if (datetime.now() - dt).total_seconds() < 43200:
-                flash("⚠️ Essa loja já foi buscada nas últimas 12 horas.", "warning")
-                return redirect("/produtos")
-
-    hoje = datetime.now().date().isoformat()
-    contador_ref = db.collection("api_contador").document(uid)
-    contador_doc = contador_ref.get()
-    contador = contador_doc.to_dict() if contador_doc.exists else {}
-
-    if contador.get("data") != hoje:
-        contador = {"data": hoje, "uso_afiliado": 0, "uso_base": 0}
-    if contador["uso_afiliado"] >= 25000:
-        flash("🚫 Limite de uso diário atingido para hoje (25.000 requisições).", "error")
-        return redirect("/produtos")
-
-    doc = db.collection("api_shopee").document(uid).get()
-    if not doc.exists:
-        flash("⚠️ Cadastre sua API Shopee antes de buscar.", "error")
-        return redirect("/minha-api")
-
-    cred = doc.to_dict()
-    app_id = cred.get("app_id")
-    app_secret = cred.get("app_secret")
-
-    query_dict = {
-        "query": f"""
-        query {{
-          productOfferV2(shopId: {shop_id}, sortType: 2, page: 1, limit: 10) {{
-            nodes {{
-              productName
-              imageUrl
-              priceMin
-              commissionRate
-              shopName
-              productLink
-              offerLink
-            }}
-          }}
-        }}
-        """
-    }
-
-    payload_str = json.dumps(query_dict, separators=(',', ':'))
-    timestamp = str(int(time.time()) + 20)
-    base_string = app_id + timestamp + payload_str + app_secret
-    signature = hashlib.sha256(base_string.encode()).hexdigest()
-    headers = {
-        "Authorization": f"SHA256 Credential={app_id}, Signature={signature}, Timestamp={timestamp}",
-        "Content-Type": "application/json"
-    }
-
     try:
-        response = requests.post("https://open-api.affiliate.shopee.com.br/graphql", headers=headers, data=payload_str)
-        if response.status_code == 200:
-            nodes = response.json().get("data", {}).get("productOfferV2", {}).get("nodes", [])
-            produtos = []
-            min_val = float(preco_min.replace(",", ".")) if preco_min else 0
-            max_val = float(preco_max.replace(",", ".")) if preco_max else float("inf")
-
-            for p in nodes:
-                preco = float(p.get("priceMin", 0))
-                if min_val <= preco <= max_val:
-                    taxa_total = float(p.get("commissionRate") or 0) * 100
-                    taxa_loja = max(taxa_total - 3, 0)
-                    comissao_live = round(preco * ((10 + taxa_loja) / 100), 2)
-                    comissao_redes = round(preco * ((3 + taxa_loja) / 100), 2)
-                    produtos.append({
-                        "titulo": p.get("productName"),
-                        "imagem": p.get("imageUrl"),
-                        "preco": preco,
-                        "comissao": taxa_loja,
-                        "comissao_live": comissao_live,
-                        "comissao_redes": comissao_redes,
-                        "loja": p.get("shopName"),
-                        "link": p.get("offerLink") or p.get("productLink")
-                    })
-
-            # 🧹 Limita total de produtos salvos por afiliado (max: 400)
-            termos_ref = db.collection("resultados_busca").document(uid).collection("termos").stream()
-            todos_termos = sorted([
-                (d.id, d.to_dict()) for d in termos_ref if d.to_dict().get("produtos")
-            ], key=lambda x: x[1].get("atualizado_em"))
-
-            total_atual = sum(len(t[1]["produtos"]) for t in todos_termos)
-            while total_atual + len(produtos) > 400 and todos_termos:
-                termo_antigo_id, termo_antigo = todos_termos.pop(0)
-                db.collection("resultados_busca").document(uid).collection("termos").document(termo_antigo_id).delete()
-                total_atual -= len(termo_antigo.get("produtos", []))
-
-            db.collection("buscas").document(uid).collection("registros").add({
-                "tipo": "loja",
-                "termo": loja_input,
-                "data": datetime.now().isoformat()
-            })
-            db.collection("resultados_busca").document(uid).collection("termos").document(termo_id).set({
-                "tipo": "loja",
-                "termo": loja_input,
-                "atualizado_em": datetime.now().isoformat(),
-                "produtos": produtos
-            })
-
-            contador["uso_afiliado"] += 1
-            db.collection("api_contador").document(uid).set(contador)
-
-            return redirect("/produtos")
-
-        flash("❌ Erro ao buscar loja.", "error")
+        for preco in (preco_min, preco_max):
+            if preco:
+                float(preco.replace(",", "."))
+    except ValueError:
+        flash("❌ Preço inválido.", "error")
         return redirect("/produtos")
 
-    except Exception as e:
-        print("❌ Erro:", e)
-        flash(f"Erro ao buscar loja: {e}", "error")
-        return redirect("/produtos")
+    return _agendar_busca(uid, "loja", loja_input, {"shop_id": shop_id},
+                          {"preco_min": preco_min, "preco_max": preco_max})
+
+@app.route("/buscar-produto/status/<job_id>")
+@verificar_login
+def status_busca_produto(job_id):
+    job = buscas_produtos.status(job_id)
+    if not job or job.get("uid") != session["usuario"]["uid"]:
+        return jsonify({"erro": "Busca não encontrada"}), 404
+    return jsonify({
+        "status": job.get("status"),
+        "termo": job.get("termo"),
+        "mensagem": job.get("mensagem"),
+        "nivel": job.get("nivel"),
+        "redirecionar": job.get("redirecionar"),
+        "quantidade": job.get("quantidade", 0)
+    })
 
 @app.route("/atualizar-buscas")
 def atualizar_buscas():
-    import time, hashlib, requests, json, re
+    import re
     from datetime import datetime
 
     print("🔄 Iniciando atualização de buscas salvas...")
@@ -1214,20 +1074,9 @@ def atualizar_buscas():
             print(f"⚠️ API não cadastrada para UID: {uid}")
             continue
 
-        cred = doc_api.to_dict()
-        app_id = cred.get("app_id") or cred.get("client_id")
-        app_secret = cred.get("app_secret") or cred.get("client_secret")
-
-        # 🔄 Limite de uso para base
-        hoje = datetime.now().date().isoformat()
-        contador_ref = db.collection("api_contador").document(uid)
-        contador_doc = contador_ref.get()
-        contador = contador_doc.to_dict() if contador_doc.exists else {}
-        if contador.get("data") != hoje:
-            contador = {"data": hoje, "uso_afiliado": 0, "uso_base": 0}
-
-        if contador["uso_base"] >= 25000:
-            print(f"🚫 UID {uid} atingiu limite de uso da base.")
+        app_id, app_secret = credenciais(doc_api.to_dict())
+        if not app_id or not app_secret:
+            print(f"⚠️ Credenciais incompletas para UID: {uid}")
             continue
 
         for r in registros_ref:
@@ -1239,110 +1088,54 @@ def atualizar_buscas():
             print(f"🔁 Atualizando: {termo} ({tipo})")
 
             if tipo == "produto":
-                query_dict = {
-                    "query": f"""
-                    query {{
-                      productOfferV2(keyword: "{termo}", sortType: 2, page: 1, limit: 10) {{
-                        nodes {{
-                          productName
-                          imageUrl
-                          priceMin
-                          commissionRate
-                          shopName
-                          productLink
-                          offerLink
-                        }}
-                      }}
-                    }}
-                    """
-                }
+                parametros = {"keyword": termo}
             elif tipo == "loja":
                 shop_id_match = re.search(r'/shop/(\d+)', termo) or re.search(r'i\.(\d+)\.', termo)
                 if not shop_id_match:
                     print(f"⚠️ Termo inválido para loja: {termo}")
                     continue
-                shop_id = shop_id_match.group(1)
-                query_dict = {
-                    "query": f"""
-                    query {{
-                      productOfferV2(shopId: {shop_id}, sortType: 2, page: 1, limit: 10) {{
-                        nodes {{
-                          productName
-                          imageUrl
-                          priceMin
-                          commissionRate
-                          shopName
-                          productLink
-                          offerLink
-                        }}
-                      }}
-                    }}
-                    """
-                }
+                parametros = {"shop_id": shop_id_match.group(1)}
             else:
                 continue
 
-            payload_str = json.dumps(query_dict, separators=(',', ':'))
-            timestamp = str(int(time.time()) + 20)
-            base_string = app_id + timestamp + payload_str + app_secret
-            signature = hashlib.sha256(base_string.encode()).hexdigest()
-            headers = {
-                "Authorization": f"SHA256 Credential={app_id}, Signature={signature}, Timestamp={timestamp}",
-                "Content-Type": "application/json"
-            }
+            paginas = cota_api.reservar(uid, "base", PAGINAS_BUSCA)
+            if not paginas:
+                print(f"⛔ Limite de base atingido para {uid}. Parando...")
+                break
 
             try:
-                response = requests.post("https://open-api.affiliate.shopee.com.br/graphql", headers=headers, data=payload_str)
-                if response.status_code == 200:
-                    nodes = response.json().get("data", {}).get("productOfferV2", {}).get("nodes", [])
-                    produtos = []
-                    for p in nodes:
-                        preco = float(p.get("priceMin", 0))
-                        taxa_total = float(p.get("commissionRate") or 0) * 100
-                        taxa_loja = max(taxa_total - 3, 0)
-                        comissao_live = round(preco * ((10 + taxa_loja) / 100), 2)
-                        comissao_redes = round(preco * ((3 + taxa_loja) / 100), 2)
-
-                        produtos.append({
-                            "titulo": p.get("productName"),
-                            "imagem": p.get("imageUrl"),
-                            "preco": preco,
-                            "comissao": taxa_loja,
-                            "comissao_live": comissao_live,
-                            "comissao_redes": comissao_redes,
-                            "loja": p.get("shopName"),
-                            "link": p.get("offerLink") or p.get("productLink")
-                        })
-
-                    # 🔐 Atualiza resultados
-                    db_firestore.collection("resultados_busca").document(uid).collection("termos").document(termo_id).set({
-                        "tipo": tipo,
-                        "termo": termo,
-                        "atualizado_em": datetime.now().isoformat(),
-                        "produtos": produtos
-                    })
+                nodes, chamadas = cliente_shopee.buscar_paginas(app_id, app_secret, paginas, **parametros)
+            except ErroShopee as e:
+                # A primeira página falhou: as outras nem foram pedidas, só ela conta
+                cota_api.devolver(uid, "base", paginas - 1)
+                print(f"⚠️ Erro da Shopee ao buscar {termo}: {e}")
+                continue
+            except Exception as e:
+                # Sem saber quantas páginas chegaram à Shopee, as fichas ficam descontadas
+                print(f"❌ Erro ao atualizar {termo}: {e}")
+                continue
+            # Páginas vindas do cache de buscas não contam na cota
+            cota_api.devolver(uid, "base", paginas - chamadas)
 
-                    # 📝 Log
-                    db_firestore.collection("logs_atualizacao").document(uid).collection("execucoes").add({
-                        "termo": termo,
-                        "tipo": tipo,
-                        "qtd_produtos": len(produtos),
-                        "atualizado_em": datetime.now().isoformat()
-                    })
+            try:
+                produtos = [produto_de_no(p) for p in nodes]
 
-                    contador["uso_base"] += 1
-                    total_atualizadas += 1
-                    if contador["uso_base"] >= 25000:
-                        print(f"⛔ Limite de base atingido para {uid}. Parando...")
-                        break
-                else:
-                    print(f"⚠️ Erro HTTP {response.status_code} ao buscar {termo}")
+                # 🔐 Atualiza resultados
+                catalogo_produtos.gravar_termo(db, uid, termo_id, tipo, termo, produtos)
+
+                # 📝 Log
+                db_firestore.collection("logs_atualizacao").document(uid).collection("execucoes").add({
+                    "termo": termo,
+                    "tipo": tipo,
+                    "qtd_produtos": len(produtos),
+                    "atualizado_em": datetime.now().isoformat()
+                })
+
+                total_atualizadas += 1
 
             except Exception as e:
                 print(f"❌ Erro ao atualizar {termo}: {e}")
 
-        db.collection("api_contador").document(uid).set(contador)
-
     print(f"✅ Atualização concluída. Total: {total_atualizadas}")
     return f"✅ Atualização concluída. Total: {total_atualizadas}", 200
 
@@ -1352,53 +1145,30 @@ def excluir_produto():
     from datetime import datetime
 
     uid = session["usuario"]["uid"]
-    termo_id = request.form.get("termo_id", "").strip()
+    produto_id = request.form.get("produto_id", "").strip()
     titulo_produto = request.form.get("titulo", "").strip()
 
-    if not titulo_produto:
+    if not produto_id and not titulo_produto:
         flash("❌ Produto inválido para exclusão.", "error")
         return redirect("/produtos")
 
-    # Se termo_id não for enviado corretamente, tenta identificar o termo correspondente
-    if not termo_id:
-        # Percorre todos os termos do usuário buscando pelo produto
-        termos_ref = db.collection("resultados_busca").document(uid).collection("termos").stream()
-        for doc in termos_ref:
-            dados = doc.to_dict()
-            produtos = dados.get("produtos", [])
-            for p in produtos:
-                if p.get("titulo") == titulo_produto:
-                    termo_id = doc.id
-                    break
-            if termo_id:
-                break
-
-    if not termo_id:
-        flash("❌ Não foi possível localizar o termo do produto.", "error")
-        return redirect("/produtos")
+    catalogo_produtos.garantir_migrado(db, uid)
+    if not produto_id:
+        # Formulários antigos só enviam o título
+        encontrado = next(iter(catalogo_produtos.buscar_por_titulos(db, uid, [titulo_produto])), None)
+        produto_id = encontrado["produto_id"] if encontrado else ""
 
-    # Continua com a exclusão
-    termo_ref = db.collection("resultados_busca").document(uid).collection("termos").document(termo_id)
-    termo_doc = termo_ref.get()
-
-    if not termo_doc.exists:
-        flash("❌ Termo não encontrado.", "error")
+    produto = catalogo_produtos.remover_produto(db, uid, produto_id) if produto_id else None
+    if not produto:
+        flash("❌ Produto não encontrado.", "error")
         return redirect("/produtos")
 
-    dados = termo_doc.to_dict()
-    produtos = dados.get("produtos", [])
-    produtos_filtrados = [p for p in produtos if p.get("titulo") != titulo_produto]
-
-    termo_ref.update({
-        "produtos": produtos_filtrados,
-        "atualizado_em": datetime.now().isoformat()
-    })
-
     # 🔐 Loga a exclusão
     db.collection("logs_exclusao").add({
         "uid": uid,
-        "termo_id": termo_id,
-        "titulo": titulo_produto,
+        "produto_id": produto_id,
+        "termos": produto.get("termos", []),
+        "titulo": produto.get("titulo"),
         "data": datetime.now().isoformat()
     })
 
@@ -1463,6 +1233,10 @@ scheduler.add_job(buscar_produtos_agendado, 'cron', hour=0, minute=1)
 scheduler.add_job(buscar_produtos_agendado, 'cron', hour=8, minute=1)
 scheduler.add_job(buscar_produtos_agendado, 'cron', hour=12, minute=1)
 scheduler.add_job(buscar_produtos_agendado, 'cron', hour=20, minute=1)
+scheduler.add_job(reconciliar_categorias, 'cron', hour=3, minute=30)
+scheduler.add_job(snapshots_painel.reconstruir_ativos, 'interval', minutes=15)
+scheduler.add_job(exclusao_logs.retomar_pendentes, 'interval', minutes=10)
+scheduler.add_job(cota_api.descarregar, 'interval', seconds=30)
 scheduler.start()
 
 @app.route("/config-bot/<bot_id>", methods=["POST"])
@@ -1532,15 +1306,9 @@ def config_bot(bot_id):
             bot_config[f"palavra_grupo_{g}"] = ""
 
     # 📦 Carrega produtos disponíveis
-    lojas = set()
-    produtos_disponiveis = []
-    termos_ref = db.collection("resultados_busca").document(uid).collection("termos").stream()
-    for doc in termos_ref:
-        termo = doc.to_dict()
-        for p in termo.get("produtos", []):
-            produtos_disponiveis.append(p)
-            if p.get("loja"):
-                lojas.add(p["loja"])
+    catalogo_produtos.garantir_migrado(db, uid)
+    produtos_disponiveis = catalogo_produtos.listar(db, uid)
+    lojas = {p["loja"] for p in produtos_disponiveis if p.get("loja")}
 
     print(f"🛍️ {len(produtos_disponiveis)} produtos carregados para exibição")
     print(f"🏪 Lojas únicas detectadas: {sorted(lojas)}")
@@ -1591,16 +1359,8 @@ def enviar_bot(bot_id):
         flash("❌ Nenhum produto selecionado para esse grupo.", "error")
         return redirect(f"/config-bot/{bot_id}")
 
-    termos_ref = db.collection("resultados_busca").document(uid).collection("termos").stream()
-    produtos_salvos = []
-    for doc in termos_ref:
-        termo = doc.to_dict()
-        produtos_salvos.extend(termo.get("produtos", []))
-
-    for p in produtos_salvos:
-        if p.get("titulo") not in produtos:
-            continue
-
+    catalogo_produtos.garantir_migrado(db, uid)
+    for p in catalogo_produtos.buscar_por_titulos(db, uid, produtos):
         titulo = p.get("titulo", "")
         preco = p.get("preco", "0")
         preco_de = p.get("preco_original") or "0"
@@ -1696,8 +1456,9 @@ def enviar_produto_individual(bot_id):
     uid = session["usuario"]["uid"]
     grupo = request.args.get("grupo")
     titulo_param = request.args.get("titulo", "").strip()
+    produto_id = request.args.get("produto_id", "").strip()
 
-    if grupo not in ["2", "3"] or not titulo_param:
+    if grupo not in ["2", "3"] or not (titulo_param or produto_id):
         flash("❌ Parâmetros inválidos.", "error")
         return redirect(f"/config-bot/{bot_id}")
 
@@ -1715,17 +1476,12 @@ def enviar_produto_individual(bot_id):
     modo_texto = bot_config.get(f"modo_texto_grupo_{grupo}", "manual")
     texto_manual = bot_config.get(f"texto_grupo_{grupo}", "").strip()
 
-    # Buscar o produto específico com base no título
-    produto = None
-    termos_ref = db.collection("resultados_busca").document(uid).collection("termos").stream()
-    for doc in termos_ref:
-        termo = doc.to_dict()
-        for p in termo.get("produtos", []):
-            if p.get("titulo") == titulo_param:
-                produto = p
-                break
-        if produto:
-            break
+    # Buscar o produto específico pelo id (ou pelo título, nos links antigos)
+    catalogo_produtos.garantir_migrado(db, uid)
+    if produto_id:
+        produto = catalogo_produtos.obter(db, uid, produto_id)
+    else:
+        produto = next(iter(catalogo_produtos.buscar_por_titulos(db, uid, [titulo_param])), None)
 
     if not produto:
         flash("❌ Produto não encontrado.", "error")
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from consultas import abandonado, dono_processo, gravar_em_batches, reivindicar
+
+# jobs_busca/{job_id}: busca de produtos (palavra-chave, link ou loja) rodando fora do request
+#   { uid, tipo, termo, termo_id, parametros, filtros, status, mensagem, nivel, redirecionar,
+#     quantidade, dono, criado_em, atualizado_em }
+# status: pendente -> executando -> concluida | erro
+# job_id = "{uid}_{hash do termo_id}": a mesma busca do mesmo usuário cai sempre no mesmo
+# documento, então repetir a busca enquanto ela está em andamento só devolve o job existente.
+COLECAO_JOBS = "jobs_busca"
+# O worker dono renova atualizado_em dos seus jobs (na fila ou rodando) a cada INTERVALO_PULSO segundos;
+# job pendente/executando sem atualização por TEMPO_ABANDONO é considerado abandonado (worker morreu)
+INTERVALO_PULSO = 30
+TEMPO_ABANDONO = timedelta(minutes=2)
+
+
+class ErroBusca(Exception):
+    """Falha esperada da busca, com a mensagem mostrada ao usuário em /produtos."""
+
+    def __init__(self, mensagem: str, nivel: str = "error", redirecionar: str | None = None):
+        super().__init__(mensagem)
+        self.mensagem = mensagem
+        self.nivel = nivel
+        self.redirecionar = redirecionar
+
+
+def id_job(uid: str, termo_id: str) -> str:
+    return f"{uid}_{hashlib.sha1(termo_id.encode()).hexdigest()[:16]}"
+
+
+class BuscasProdutos:
+    """
+    Roda as buscas na Shopee num executor limitado a `max_jobs` threads, com no
+    máximo `max_fila` jobs aguardando por worker. O request só grava o job (uma
+    transação) e redireciona; o progresso fica no documento do job, consultado
+    por /buscar-produto/status/<job_id> de qualquer worker.
+    `executar_busca(job)` faz a busca e devolve {mensagem, quantidade}; erros
+    esperados vêm como ErroBusca.
+    Enquanto o job espera na fila ou roda, uma thread renova o atualizado_em
+    dele; só o job de um worker que parou de responder é tratado como
+    abandonado e pode ser refeito.
+    """
+
+    def __init__(self, db, executar_busca, max_jobs: int = 4, max_fila: int = 50):
+        self.db = db
+        self.executar_busca = executar_busca
+        self.max_fila = max_fila
+        self.executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="buscas")
+        self.dono = dono_processo()
+        self._lock = threading.Lock()
+        self._na_fila = 0
+        self._ativos: set = set()
+        self._thread_pulso = None
+        self._pid = None
+
+    @classmethod
+    def do_ambiente(cls, db, executar_busca) -> "BuscasProdutos":
+        return cls(
+            db,
+            executar_busca,
+            max_jobs=int(os.getenv("BUSCAS_PARALELAS", "4")),
+            max_fila=int(os.getenv("BUSCAS_FILA_MAX", "50"))
+        )
+
+    def _ref(self, job_id: str):
+        return self.db.collection(COLECAO_JOBS).document(job_id)
+
+    def agendar(self, uid: str, tipo: str, termo: str, termo_id: str, parametros: dict,
+                filtros: dict | None = None) -> tuple[str, bool]:
+        """
+        Cria o job e o envia ao executor. Retorna (job_id, novo); novo=False
+        quando a mesma busca já estava em andamento e foi reaproveitada.
+        """
+        # Reserva a vaga na fila antes de criar o job; devolvida se ele não for criado
+        with self._lock:
+            if self._na_fila >= self.max_fila:
+                raise ErroBusca("⚠️ Muitas buscas em andamento. Tente novamente em instantes.", "warning")
+            self._na_fila += 1
+
+        job_id = id_job(uid, termo_id)
+        ref = self._ref(job_id)
+
+        def _criar(transacao, job, agora):
+            if job.get("status") in ("pendente", "executando") and not abandonado(job, TEMPO_ABANDONO, agora):
+                return False
+            transacao.set(ref, {
+                "uid": uid,
+                "tipo": tipo,
+                "termo": termo,
+                "termo_id": termo_id,
+                "parametros": parametros,
+                "filtros": filtros or {},
+                "status": "pendente",
+                "mensagem": None,
+                "nivel": None,
+                "redirecionar": None,
+                "quantidade": 0,
+                "dono": self.dono,
+                "criado_em": agora,
+                "atualizado_em": agora
+            })
+            return True
+
+        try:
+            novo = reivindicar(self.db, ref, _criar)
+        except Exception:
+            self._liberar_vaga(job_id)
+            raise
+        if not novo:
+            self._liberar_vaga(job_id)
+            return job_id, False
+
+        with self._lock:
+            self._ativos.add(job_id)
+        self._garantir_pulso()
+        self.executor.submit(self.executar, job_id)
+        return job_id, True
+
+    def _liberar_vaga(self, job_id: str):
+        with self._lock:
+            self._na_fila -= 1
+            self._ativos.discard(job_id)
+
+    def _garantir_pulso(self):
+        # A thread é do processo (gunicorn faz fork dos workers)
+        with self._lock:
+            if self._thread_pulso is not None and self._pid == os.getpid() and self._thread_pulso.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread_pulso = threading.Thread(target=self._pulsar, name="buscas-pulso", daemon=True)
+            self._thread_pulso.start()
+
+    def _pulsar(self):
+        """Renova atualizado_em dos jobs deste worker, em batches."""
+        while True:
+            time.sleep(INTERVALO_PULSO)
+            with self._lock:
+                ativos = list(self._ativos)
+            agora = datetime.now(timezone.utc)
+            # Falhas ficam para o próximo pulso (bem antes de TEMPO_ABANDONO)
+            gravar_em_batches(self.db, ativos, lambda b, job_id: b.update(self._ref(job_id), {"atualizado_em": agora}))
+
+    def status(self, job_id: str) -> dict | None:
+        doc = self._ref(job_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def executar(self, job_id: str):
+        ref = self._ref(job_id)
+        try:
+            job = ref.get().to_dict()
+            ref.update({"status": "executando", "dono": self.dono, "atualizado_em": datetime.now(timezone.utc)})
+            resultado = self.executar_busca(job)
+            ref.update({
+                "status": "concluida",
+                "mensagem": resultado.get("mensagem"),
+                "nivel": "success",
+                "quantidade": resultado.get("quantidade", 0),
+                "atualizado_em": datetime.now(timezone.utc)
+            })
+        except ErroBusca as e:
+            ref.update({"status": "erro", "mensagem": e.mensagem, "nivel": e.nivel,
+                        "redirecionar": e.redirecionar, "atualizado_em": datetime.now(timezone.utc)})
+        except Exception as e:
+            print(f"❌ Erro na busca {job_id}: {e}")
+            ref.update({"status": "erro", "mensagem": f"Erro inesperado: {e}", "nivel": "error",
+                        "atualizado_em": datetime.now(timezone.utc)})
+        finally:
+            self._liberar_vaga(job_id)
@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+from datetime import datetime
+
+from firebase_admin import firestore
+
+from consultas import gravar_em_batches
+
+# resultados_busca/{uid}/catalogo/{produto_id}: um documento por produto
+#   { produto_id, item_id, shop_id, titulo, titulo_normalizado, imagem, preco, comissao, comissao_live,
+#     comissao_redes, loja, link, termos: [termo_id], atualizado_em }
+# resultados_busca/{uid}/termos/{termo_id}: só referencia os produtos
+#   { tipo, termo, atualizado_em, produtos_ids: [produto_id], quantidade }
+# produto_id = "{shop_id}_{item_id}"; produtos antigos sem ids usam um hash do título.
+# resultados_busca/{uid}: metadados do catálogo
+#   { versao_catalogo, catalogo_migrado, titulos_normalizados, total_produtos,
+#     idade_termos: [{termo_id, atualizado_em, quantidade}] (do mais antigo para o mais novo) }
+# versao_catalogo é incrementada a cada escrita (invalida a vista de /produtos); total_produtos e
+# idade_termos são mantidos em transação e bastam para aplicar o limite de 400 produtos.
+COLECAO_RESULTADOS = "resultados_busca"
+TAMANHO_FILTRO_IN = 30
+LIMITE_PRODUTOS = 400
+
+
+def normalizar_titulo(titulo: str | None) -> str:
+    """Títulos comparados sem diferenciar maiúsculas nem espaços nas pontas."""
+    return (titulo or "").strip().lower()
+
+
+def id_produto(produto: dict) -> str:
+    if produto.get("shop_id") and produto.get("item_id"):
+        return f"{produto['shop_id']}_{produto['item_id']}"
+    titulo = normalizar_titulo(produto.get("titulo"))
+    return "t_" + hashlib.sha1(titulo.encode()).hexdigest()[:20]
+
+
+def catalogo_ref(db, uid: str):
+    return db.collection(COLECAO_RESULTADOS).document(uid).collection("catalogo")
+
+
+def termos_ref(db, uid: str):
+    return db.collection(COLECAO_RESULTADOS).document(uid).collection("termos")
+
+
+def versao(db, uid: str) -> int:
+    doc = db.collection(COLECAO_RESULTADOS).document(uid).get(field_paths=["versao_catalogo"])
+    return int((doc.to_dict() or {}).get("versao_catalogo") or 0) if doc.exists else 0
+
+
+def _incrementar_versao(batch, db, uid: str, extras: dict | None = None):
+    batch.set(db.collection(COLECAO_RESULTADOS).document(uid),
+              {"versao_catalogo": firestore.Increment(1), **(extras or {})}, merge=True)
+
+
+def _meta_ref(db, uid: str):
+    return db.collection(COLECAO_RESULTADOS).document(uid)
+
+
+def _montar_meta(entradas: dict) -> dict:
+    idade = sorted(entradas.values(), key=lambda e: e.get("atualizado_em") or "")
+    return {"idade_termos": idade, "total_produtos": sum(int(e.get("quantidade") or 0) for e in idade)}
+
+
+def _atualizar_meta(db, uid: str, aplicar):
+    """Aplica `aplicar(entradas)` ({termo_id: entrada}) ao índice de idade numa transação."""
+    ref = _meta_ref(db, uid)
+
+    @firestore.transactional
+    def _executar(transacao):
+        doc = ref.get(transaction=transacao)
+        meta = doc.to_dict() if doc.exists else {}
+        if "idade_termos" not in meta:
+            return False
+        entradas = {e["termo_id"]: e for e in meta["idade_termos"]}
+        aplicar(entradas)
+        transacao.set(ref, _montar_meta(entradas), merge=True)
+        return True
+
+    if not _executar(db.transaction()):
+        reconstruir_meta(db, uid)
+
+
+def reconstruir_meta(db, uid: str) -> dict:
+    """Recalcula total_produtos e idade_termos a partir dos termos."""
+    entradas = {}
+    for doc in termos_ref(db, uid).select(["atualizado_em", "quantidade"]).stream():
+        dados = doc.to_dict()
+        entradas[doc.id] = {
+            "termo_id": doc.id,
+            "atualizado_em": dados.get("atualizado_em"),
+            "quantidade": int(dados.get("quantidade") or 0)
+        }
+    meta = _montar_meta(entradas)
+    _meta_ref(db, uid).set(meta, merge=True)
+    return meta
+
+
+def _gravar(db, uid: str, operacoes: list):
+    """Aplica as operações (funções que recebem o batch) em batches de até 500, incrementando a versão."""
+    operacoes = operacoes + [lambda b: _incrementar_versao(b, db, uid)]
+    gravar_em_batches(db, operacoes, lambda b, operacao: operacao(b), propagar_erro=True)
+
+
+def _desvincular(db, uid: str, termo_ids: set, produtos_ids: list[str], operacoes: list):
+    """Tira os termos dos produtos; o produto que não pertence a mais nenhum termo é apagado."""
+    if not produtos_ids:
+        return
+    refs = [catalogo_ref(db, uid).document(pid) for pid in dict.fromkeys(produtos_ids)]
+    for doc in db.get_all(refs, field_paths=["termos"]):
+        if not doc.exists:
+            continue
+        restantes = [t for t in (doc.to_dict().get("termos") or []) if t not in termo_ids]
+        if restantes:
+            operacoes.append(lambda b, r=doc.reference: b.update(r, {"termos": firestore.ArrayRemove(list(termo_ids))}))
+        else:
+            operacoes.append(lambda b, r=doc.reference: b.delete(r))
+
+
+def gravar_termo(db, uid: str, termo_id: str, tipo: str, termo: str, produtos: list[dict],
+                 atualizado_em: str | None = None) -> list[str]:
+    """Grava o resultado de uma busca: um documento por produto e o termo referenciando-os."""
+    agora = atualizado_em or datetime.now().isoformat()
+    ref_termo = termos_ref(db, uid).document(termo_id)
+    anterior = ref_termo.get()
+    ids_anteriores = set((anterior.to_dict() or {}).get("produtos_ids") or []) if anterior.exists else set()
+
+    ids, operacoes = [], []
+    for produto in produtos:
+        pid = id_produto(produto)
+        if pid in ids:
+            continue
+        ids.append(pid)
+        dados = {**produto, "produto_id": pid, "titulo_normalizado": normalizar_titulo(produto.get("titulo")),
+                 "termos": firestore.ArrayUnion([termo_id]), "atualizado_em": agora}
+        operacoes.append(lambda b, r=catalogo_ref(db, uid).document(pid), d=dados: b.set(r, d, merge=True))
+
+    _desvincular(db, uid, {termo_id}, [pid for pid in ids_anteriores if pid not in ids], operacoes)
+    operacoes.append(lambda b: b.set(ref_termo, {
+        "tipo": tipo,
+        "termo": termo,
+        "atualizado_em": agora,
+        "produtos_ids": ids,
+        "quantidade": len(ids)
+    }))
+    _gravar(db, uid, operacoes)
+    _atualizar_meta(db, uid, lambda entradas: entradas.__setitem__(
+        termo_id, {"termo_id": termo_id, "atualizado_em": agora, "quantidade": len(ids)}
+    ))
+    return ids
+
+
+def remover_termos(db, uid: str, termo_ids: list[str]):
+    """Apaga os termos e desvincula (ou apaga) os produtos deles, tudo em batch."""
+    if not termo_ids:
+        return
+    operacoes, produtos_ids = [], []
+    docs = db.get_all([termos_ref(db, uid).document(t) for t in termo_ids], field_paths=["produtos_ids"])
+    for doc in docs:
+        if doc.exists:
+            produtos_ids.extend(doc.to_dict().get("produtos_ids") or [])
+        operacoes.append(lambda b, r=doc.reference: b.delete(r))
+    _desvincular(db, uid, set(termo_ids), produtos_ids, operacoes)
+    _gravar(db, uid, operacoes)
+
+    def retirar(entradas):
+        for termo_id in termo_ids:
+            entradas.pop(termo_id, None)
+
+    _atualizar_meta(db, uid, retirar)
+
+
+def aplicar_limite(db, uid: str, novos: int, ignorar: str | None = None, limite: int = LIMITE_PRODUTOS):
+    """
+    Remove os termos mais antigos até caberem `novos` produtos no limite por
+    afiliado. Uma leitura dos metadados decide quais saem; a remoção é um batch.
+    """
+    doc = _meta_ref(db, uid).get(field_paths=["idade_termos"])
+    meta = doc.to_dict() if doc.exists else {}
+    idade = meta["idade_termos"] if "idade_termos" in meta else reconstruir_meta(db, uid)["idade_termos"]
+
+    termos = [e for e in idade if e["termo_id"] != ignorar]
+    total = sum(int(e.get("quantidade") or 0) for e in termos)
+    remover = []
+    while total + novos > limite and termos:
+        antigo = termos.pop(0)
+        remover.append(antigo["termo_id"])
+        total -= int(antigo.get("quantidade") or 0)
+    remover_termos(db, uid, remover)
+
+
+def listar(db, uid: str, limite: int = LIMITE_PRODUTOS) -> list[dict]:
+    """Produtos do afiliado, mais recentes primeiro."""
+    query = catalogo_ref(db, uid).order_by("atualizado_em", direction=firestore.Query.DESCENDING).limit(limite)
+    return [doc.to_dict() for doc in query.stream()]
+
+
+def obter(db, uid: str, produto_id: str) -> dict | None:
+    doc = catalogo_ref(db, uid).document(produto_id).get()
+    return doc.to_dict() if doc.exists else None
+
+
+def buscar_por_titulos(db, uid: str, titulos: list[str]) -> list[dict]:
+    """Produtos com estes títulos, sem diferenciar maiúsculas/espaços (filtro `in` em blocos de 30)."""
+    titulos = [t for t in dict.fromkeys(normalizar_titulo(t) for t in titulos) if t]
+    produtos = []
+    for i in range(0, len(titulos), TAMANHO_FILTRO_IN):
+        query = catalogo_ref(db, uid).where("titulo_normalizado", "in", titulos[i:i + TAMANHO_FILTRO_IN])
+        produtos.extend(doc.to_dict() for doc in query.stream())
+    return produtos
+
+
+def remover_produto(db, uid: str, produto_id: str) -> dict | None:
+    """Apaga o produto do catálogo e tira a referência dos termos dele."""
+    produto = obter(db, uid, produto_id)
+    if produto is None:
+        return None
+    batch = db.batch()
+    batch.delete(catalogo_ref(db, uid).document(produto_id))
+    refs = [termos_ref(db, uid).document(t) for t in produto.get("termos") or []]
+    for doc in db.get_all(refs, field_paths=["quantidade"]) if refs else []:
+        if doc.exists:
+            batch.update(doc.reference, {
+                "produtos_ids": firestore.ArrayRemove([produto_id]),
+                "quantidade": firestore.Increment(-1)
+            })
+    _incrementar_versao(batch, db, uid)
+    batch.commit()
+
+    def descontar(entradas):
+        for termo_id in produto.get("termos") or []:
+            if termo_id in entradas:
+                entradas[termo_id]["quantidade"] = max(0, int(entradas[termo_id].get("quantidade") or 0) - 1)
+
+    _atualizar_meta(db, uid, descontar)
+    return produto
+
+
+# 🔁 Migração dos termos antigos (produtos em array dentro do termo), feita por usuário no primeiro acesso
+_migrados: set = set()
+# Um lock por uid: a migração de um usuário não bloqueia os outros
+_locks_migracao: dict = {}
+_lock_locks = threading.Lock()
+
+
+def _lock_migracao(uid: str) -> threading.Lock:
+    with _lock_locks:
+        return _locks_migracao.setdefault(uid, threading.Lock())
+
+
+def normalizar_titulos(db, uid: str) -> int:
+    """Preenche titulo_normalizado nos produtos gravados antes do campo existir."""
+    operacoes = []
+    for doc in catalogo_ref(db, uid).select(["titulo", "titulo_normalizado"]).stream():
+        dados = doc.to_dict()
+        if "titulo_normalizado" not in dados:
+            operacoes.append(lambda b, r=doc.reference, t=dados.get("titulo"): b.update(
+                r, {"titulo_normalizado": normalizar_titulo(t)}
+            ))
+    gravar_em_batches(db, operacoes, lambda b, operacao: operacao(b), propagar_erro=True)
+    _meta_ref(db, uid).set({"titulos_normalizados": True}, merge=True)
+    return len(operacoes)
+
+
+def migrar_usuario(db, uid: str) -> int:
+    """Move os arrays `produtos` dos termos de um usuário para o catálogo."""
+    migrados = 0
+    for doc in termos_ref(db, uid).stream():
+        dados = doc.to_dict()
+        if "produtos" not in dados:
+            continue
+        # gravar_termo sobrescreve o termo sem o array, mantendo a data original da busca
+        gravar_termo(db, uid, doc.id, dados.get("tipo"), dados.get("termo"), dados.get("produtos") or [],
+                     atualizado_em=dados.get("atualizado_em"))
+        migrados += 1
+    reconstruir_meta(db, uid)
+    batch = db.batch()
+    _incrementar_versao(batch, db, uid, {"catalogo_migrado": True})
+    batch.commit()
+    return migrados
+
+
+def garantir_migrado(db, uid: str):
+    if uid in _migrados:
+        return
+    with _lock_migracao(uid):
+        if uid in _migrados:
+            return
+        doc = db.collection(COLECAO_RESULTADOS).document(uid).get()
+        meta = doc.to_dict() if doc.exists else {}
+        if not meta.get("catalogo_migrado"):
+            total = migrar_usuario(db, uid)
+            print(f"📦 Catálogo de {uid} migrado: {total} termos")
+        if not meta.get("titulos_normalizados"):
+            normalizar_titulos(db, uid)
+        _migrados.add(uid)
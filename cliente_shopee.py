@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from cache import CacheLRU
+
+# 🛒 Cliente da API GraphQL de afiliados da Shopee
+URL_GRAPHQL = "https://open-api.affiliate.shopee.com.br/graphql"
+# Código de erro da Shopee para limite de requisições excedido
+CODIGO_LIMITE_REQUISICOES = 10030
+
+QUERY_PRODUTOS = """
+query Produtos($keyword: String, $productCatId: Int, $shopId: Int64, $itemId: Int64,
+               $sortType: Int, $page: Int, $limit: Int) {
+  productOfferV2(keyword: $keyword, productCatId: $productCatId, shopId: $shopId, itemId: $itemId,
+                 sortType: $sortType, page: $page, limit: $limit) {
+    nodes {
+      itemId
+      shopId
+      productName
+      imageUrl
+      priceMin
+      commissionRate
+      shopName
+      productLink
+      offerLink
+    }
+    pageInfo {
+      page
+      hasNextPage
+    }
+  }
+}
+"""
+
+
+class ErroShopee(Exception):
+    pass
+
+
+def credenciais(dados: dict) -> tuple[str | None, str | None]:
+    """(app_id, app_secret) do documento api_shopee/{uid}, aceitando os nomes antigos."""
+    return (
+        dados.get("app_id") or dados.get("client_id"),
+        dados.get("app_secret") or dados.get("client_secret")
+    )
+
+
+def produto_de_no(no: dict) -> dict:
+    """Converte um node de productOfferV2 no produto salvo, com as comissões calculadas."""
+    preco = float(no.get("priceMin") or 0)
+    taxa_total = float(no.get("commissionRate") or 0) * 100
+    taxa_loja = max(taxa_total - 3, 0)
+    return {
+        "item_id": str(no.get("itemId") or ""),
+        "shop_id": str(no.get("shopId") or ""),
+        "titulo": no.get("productName"),
+        "imagem": no.get("imageUrl"),
+        "preco": preco,
+        "comissao": taxa_loja,
+        "comissao_live": round(preco * ((10 + taxa_loja) / 100), 2),
+        "comissao_redes": round(preco * ((3 + taxa_loja) / 100), 2),
+        "loja": no.get("shopName"),
+        "link": no.get("offerLink") or no.get("productLink")
+    }
+
+
+def chave_busca(app_id: str, keyword: str | None = None, categoria=None, shop_id=None, item_id=None,
+                pagina: int = 1, limite: int = 10) -> tuple:
+    """
+    Chave do cache de buscas: a query normalizada (palavra-chave + categoria, ou
+    loja/item) e a conta de afiliado. O offerLink dos nodes é o link de
+    rastreio da conta, então o resultado só é compartilhado entre os usuários
+    que usam as mesmas credenciais.
+    """
+    termo = " ".join((keyword or "").lower().split())
+    return (app_id, termo, str(categoria or ""), str(shop_id or ""), str(item_id or ""), pagina, limite)
+
+
+class ClienteShopee:
+    """
+    Session HTTP compartilhada (conexões keep-alive reaproveitadas), timeouts
+    de conexão/leitura e retentativas com backoff exponencial em 5xx, 429 e
+    erro de limite de requisições da Shopee. Guarda a latência das chamadas.
+    """
+
+    def __init__(self, tamanho_pool: int = 20, timeout_conexao: float = 3.0, timeout_leitura: float = 10.0,
+                 max_tentativas: int = 3, backoff: float = 0.5, cache: CacheLRU | None = None,
+                 paralelismo: int = 4):
+        self.cache = cache
+        # Páginas de uma mesma busca são pedidas em paralelo, com no máximo `paralelismo` por vez
+        self.executor = ThreadPoolExecutor(max_workers=paralelismo, thread_name_prefix="shopee")
+        self.sessao = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=tamanho_pool, pool_maxsize=tamanho_pool)
+        self.sessao.mount("https://", adaptador)
+        self.timeout = (timeout_conexao, timeout_leitura)
+        self.max_tentativas = max(1, max_tentativas)
+        self.backoff = backoff
+
+        self._lock = threading.Lock()
+        self._latencias = deque(maxlen=500)
+        self.chamadas = 0
+        self.falhas = 0
+        self.retentativas = 0
+
+    @classmethod
+    def do_ambiente(cls) -> "ClienteShopee":
+        return cls(
+            tamanho_pool=int(os.getenv("SHOPEE_POOL", "20")),
+            timeout_conexao=float(os.getenv("SHOPEE_TIMEOUT_CONEXAO", "3")),
+            timeout_leitura=float(os.getenv("SHOPEE_TIMEOUT_LEITURA", "10")),
+            max_tentativas=int(os.getenv("SHOPEE_TENTATIVAS", "3")),
+            paralelismo=int(os.getenv("SHOPEE_PARALELISMO", "4")),
+            cache=CacheLRU(
+                tamanho_max=int(os.getenv("CACHE_BUSCAS_TAMANHO", "5000")),
+                ttl=float(os.getenv("CACHE_BUSCAS_TTL", "1800"))
+            )
+        )
+
+    def _cabecalhos(self, app_id: str, app_secret: str, payload: str) -> dict:
+        timestamp = str(int(time.time()) + 20)
+        assinatura = hashlib.sha256((app_id + timestamp + payload + app_secret).encode()).hexdigest()
+        return {
+            "Authorization": f"SHA256 Credential={app_id}, Signature={assinatura}, Timestamp={timestamp}",
+            "Content-Type": "application/json"
+        }
+
+    def _registrar(self, inicio: float, sucesso: bool):
+        with self._lock:
+            self.chamadas += 1
+            self._latencias.append(time.monotonic() - inicio)
+            if not sucesso:
+                self.falhas += 1
+
+    def executar(self, app_id: str, app_secret: str, query: str, variaveis: dict | None = None) -> dict:
+        """Executa a query e retorna o campo `data`. Lança ErroShopee se falhar após as tentativas."""
+        # Variáveis None ficam de fora: o argumento é tratado como não informado
+        variaveis = {k: v for k, v in (variaveis or {}).items() if v is not None}
+        payload = json.dumps({"query": query, "variables": variaveis}, separators=(",", ":"))
+        inicio = time.monotonic()
+        erro = None
+
+        for tentativa in range(self.max_tentativas):
+            if tentativa:
+                with self._lock:
+                    self.retentativas += 1
+                time.sleep(self.backoff * (2 ** (tentativa - 1)) + random.uniform(0, self.backoff))
+
+            try:
+                # A assinatura leva o timestamp, então é refeita a cada tentativa
+                resposta = self.sessao.post(URL_GRAPHQL, data=payload, timeout=self.timeout,
+                                            headers=self._cabecalhos(app_id, app_secret, payload))
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                erro = ErroShopee(f"Falha de conexão com a Shopee: {e}")
+                continue
+            except requests.RequestException as e:
+                self._registrar(inicio, False)
+                raise ErroShopee(f"Erro na requisição à Shopee: {e}") from e
+
+            if resposta.status_code == 429 or resposta.status_code >= 500:
+                erro = ErroShopee(f"HTTP {resposta.status_code} da Shopee")
+                continue
+            if resposta.status_code != 200:
+                self._registrar(inicio, False)
+                raise ErroShopee(f"HTTP {resposta.status_code} da Shopee")
+
+            try:
+                corpo = resposta.json()
+            except ValueError:
+                # Resposta cortada ou HTML de erro do gateway: tenta de novo
+                erro = ErroShopee("Resposta inválida da Shopee (não é JSON)")
+                continue
+            if not isinstance(corpo, dict):
+                erro = ErroShopee("Resposta inválida da Shopee")
+                continue
+            erros = corpo.get("errors") or []
+            if any((e.get("extensions") or {}).get("code") == CODIGO_LIMITE_REQUISICOES for e in erros):
+                erro = ErroShopee("Limite de requisições da Shopee atingido")
+                continue
+            if erros:
+                self._registrar(inicio, False)
+                raise ErroShopee(erros[0].get("message", "Erro na API da Shopee"))
+
+            self._registrar(inicio, True)
+            return corpo.get("data") or {}
+
+        self._registrar(inicio, False)
+        raise erro
+
+    def buscar_pagina(self, app_id: str, app_secret: str, keyword: str | None = None,
+                      categoria: int | None = None, shop_id: int | None = None, item_id: int | None = None,
+                      pagina: int = 1, limite: int = 10) -> tuple[list[dict], bool]:
+        """(nodes, tem_proxima) de productOfferV2 (ordenados por vendas quando há keyword ou loja)."""
+        variaveis = {
+            "keyword": keyword,
+            "productCatId": int(categoria) if categoria else None,
+            "shopId": int(shop_id) if shop_id else None,
+            "itemId": int(item_id) if item_id else None,
+            "sortType": None if item_id else 2,
+            "page": pagina,
+            "limit": limite
+        }
+        dados = self.executar(app_id, app_secret, QUERY_PRODUTOS, variaveis)
+        resultado = dados.get("productOfferV2") or {}
+        nodes = resultado.get("nodes") or []
+        info = resultado.get("pageInfo") or {}
+        # Sem pageInfo, uma página cheia indica que pode haver mais
+        tem_proxima = bool(info["hasNextPage"]) if "hasNextPage" in info else len(nodes) >= limite
+        return nodes, tem_proxima
+
+    def buscar_produtos(self, app_id: str, app_secret: str, **parametros) -> list[dict]:
+        """Só os nodes de buscar_pagina."""
+        return self.buscar_pagina(app_id, app_secret, **parametros)[0]
+
+    def buscar_produtos_em_cache(self, app_id: str, app_secret: str, **parametros) -> tuple[list[dict], bool, bool]:
+        """
+        Igual a buscar_pagina, passando antes pelo cache de buscas.
+        Retorna (nodes, tem_proxima, veio_do_cache); quem chama só desconta a cota se não veio.
+        Os nodes ficam crus no cache: as comissões são calculadas a cada uso.
+        """
+        if self.cache is None:
+            return (*self.buscar_pagina(app_id, app_secret, **parametros), False)
+        chave = chave_busca(app_id, **parametros)
+        em_cache = self.cache.obter(chave)
+        if em_cache is not None:
+            nodes, tem_proxima = em_cache
+            return list(nodes), tem_proxima, True
+        nodes, tem_proxima = self.buscar_pagina(app_id, app_secret, **parametros)
+        self.cache.definir(chave, (tuple(nodes), tem_proxima))
+        return nodes, tem_proxima, False
+
+    def buscar_paginas(self, app_id: str, app_secret: str, paginas: int = 1,
+                       **parametros) -> tuple[list[dict], int]:
+        """
+        Busca a página 1 e, só se ela indicar hasNextPage, as páginas 2..`paginas`
+        em paralelo (cada uma pelo cache), juntando os nodes sem repetir produto.
+        Retorna (nodes, chamadas_feitas_na_api), para a cota ser descontada por
+        página realmente pedida à Shopee.
+        Erro na primeira página é propagado como ErroShopee, e nesse caso só ela
+        foi pedida; nas demais, a página é ignorada.
+        """
+        try:
+            primeira, tem_proxima, do_cache = self.buscar_produtos_em_cache(app_id, app_secret, pagina=1, **parametros)
+        except ErroShopee:
+            raise
+        except Exception as e:
+            raise ErroShopee(f"Erro ao buscar na Shopee: {e}") from e
+        chamadas = 0 if do_cache else 1
+        resultados = [primeira]
+
+        if tem_proxima and paginas > 1:
+            futuros = [
+                self.executor.submit(self.buscar_produtos_em_cache, app_id, app_secret, pagina=pagina, **parametros)
+                for pagina in range(2, paginas + 1)
+            ]
+            for pagina, futuro in enumerate(futuros, start=2):
+                try:
+                    nodes_pagina, _, do_cache = futuro.result()
+                except Exception as e:
+                    # A chamada foi feita (e possivelmente cobrada) mesmo sem resultado
+                    chamadas += 1
+                    print(f"⚠️ Página {pagina} da busca ignorada: {e}")
+                    continue
+                chamadas += 0 if do_cache else 1
+                resultados.append(nodes_pagina)
+
+        nodes, vistos = [], set()
+        for nodes_pagina in resultados:
+            for no in nodes_pagina:
+                chave = (no.get("shopId"), no.get("itemId")) if no.get("itemId") else no.get("productName")
+                if chave in vistos:
+                    continue
+                vistos.add(chave)
+                nodes.append(no)
+        return nodes, chamadas
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            latencias = sorted(self._latencias)
+            chamadas, falhas, retentativas = self.chamadas, self.falhas, self.retentativas
+
+        def percentil(p):
+            return round(latencias[min(len(latencias) - 1, int(len(latencias) * p))] * 1000, 1) if latencias else 0
+
+        return {
+            "chamadas": chamadas,
+            "falhas": falhas,
+            "retentativas": retentativas,
+            "latencia_ms": {"p50": percentil(0.5), "p95": percentil(0.95), "max": percentil(1.0)},
+            "cache_buscas": self.cache.estatisticas() if self.cache is not None else None
+        }
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, wait
+from datetime import datetime, timedelta, timezone
+
+from firebase_admin import firestore
+
+# 🔢 Agregações no servidor do Firestore: o custo não depende do volume de documentos
+
+
+def contar(query) -> int:
+    """Quantidade de documentos da query (count() no servidor)."""
+    resultado = query.count(alias="total").get()
+    return int(resultado[0][0].value or 0)
+
+
+def somar(query, campo: str):
+    """Soma do campo numérico nos documentos da query (sum() no servidor)."""
+    resultado = query.sum(campo, alias="soma").get()
+    return resultado[0][0].value or 0
+
+
+# ⚡ Pool compartilhado entre as requisições para disparar leituras independentes em paralelo
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CONSULTAS_THREADS", "16")),
+    thread_name_prefix="consultas"
+)
+
+
+def executar_em_paralelo(tarefas: dict, timeout: float = 5.0, falhas: set | None = None,
+                         executor: ThreadPoolExecutor | None = None, tempo_da_execucao: bool = False) -> dict:
+    """
+    Executa as consultas em paralelo e retorna {nome: resultado}.
+
+    tarefas: {nome: (funcao, fallback)} ou {nome: (funcao, fallback, timeout)}.
+    Se a consulta falhar ou passar do seu timeout, o nome recebe o fallback
+    (e é adicionado a `falhas`, se informado).
+    `executor` troca o pool compartilhado por um próprio (trabalhos longos).
+    A latência total fica próxima da consulta mais lenta, não da soma.
+
+    O timeout conta a partir do envio ao pool; com tempo_da_execucao, conta a
+    partir de quando a tarefa começa a rodar, então as que esperam na fila de
+    um pool pequeno não estouram o prazo antes de começar.
+    """
+    executor = executor or _executor
+    inicio = time.monotonic()
+    iniciadas = {}
+
+    def _marcar(nome, funcao):
+        def _executar():
+            iniciadas[nome] = time.monotonic()
+            return funcao()
+        return _executar
+
+    futuros = {}
+    for nome, tarefa in tarefas.items():
+        funcao, fallback = tarefa[0], tarefa[1]
+        limite = tarefa[2] if len(tarefa) > 2 else timeout
+        futuros[nome] = (executor.submit(_marcar(nome, funcao)), fallback, limite)
+
+    resultados = {}
+    for nome, (futuro, fallback, limite) in futuros.items():
+        if tempo_da_execucao:
+            # Aguarda a tarefa sair da fila antes de começar a contar o timeout dela
+            while nome not in iniciadas and not futuro.done():
+                wait([futuro], timeout=0.05)
+        comeco = iniciadas.get(nome, inicio) if tempo_da_execucao else inicio
+        restante = max(0.0, limite - (time.monotonic() - comeco))
+        try:
+            resultados[nome] = futuro.result(timeout=restante)
+        except FuturesTimeout:
+            futuro.cancel()
+            print(f"⏱️ Consulta '{nome}' excedeu {limite}s, usando valor padrão")
+            resultados[nome] = fallback
+            if falhas is not None:
+                falhas.add(nome)
+        except Exception as e:
+            print(f"Erro na consulta '{nome}': {e}")
+            resultados[nome] = fallback
+            if falhas is not None:
+                falhas.add(nome)
+    return resultados
+
+
+# 📄 Paginação por cursor (start_after/end_before no último/primeiro documento da página)
+TAMANHO_MAX_PAGINA = 100
+
+
+def paginar(query, colecao, tamanho: int = 20, cursor: str | None = None, direcao: str = "proxima",
+            com_total: bool = True) -> dict:
+    """
+    Uma página da query (já ordenada, ex.: por criado_em). O cursor é o id do
+    documento de borda; o desempate por id é adicionado pelo Firestore.
+
+    Retorna {docs, proximo, anterior, total}: proximo/anterior são os cursores
+    das páginas vizinhas (None quando não existem) e total vem de count().
+    """
+    tamanho = max(1, min(tamanho, TAMANHO_MAX_PAGINA))
+
+    def buscar_pagina():
+        borda = colecao.document(cursor).get() if cursor else None
+        if borda is not None and not borda.exists:
+            borda = None
+
+        if borda is not None and direcao == "anterior":
+            docs = list(query.end_before(borda).limit_to_last(tamanho + 1).get())
+            tem_anterior = len(docs) > tamanho
+            return docs[-tamanho:], True, tem_anterior
+
+        pagina = query.start_after(borda) if borda is not None else query
+        docs = list(pagina.limit(tamanho + 1).stream())
+        return docs[:tamanho], len(docs) > tamanho, borda is not None
+
+    tarefas = {"pagina": (buscar_pagina, ([], False, False), 10.0)}
+    if com_total:
+        tarefas["total"] = (lambda: contar(query), None)
+    resultados = executar_em_paralelo(tarefas)
+
+    docs, tem_proxima, tem_anterior = resultados["pagina"]
+    return {
+        "docs": docs,
+        "proximo": docs[-1].id if docs and tem_proxima else None,
+        "anterior": docs[0].id if docs and tem_anterior else None,
+        "total": resultados.get("total")
+    }
+
+
+# 🧱 Gravação em batches: limite de operações por batch do Firestore
+MAX_OPERACOES_BATCH = 500
+
+
+def gravar_em_batches(db, itens: list, aplicar, tamanho: int = MAX_OPERACOES_BATCH,
+                      propagar_erro: bool = False) -> list:
+    """
+    Chama `aplicar(batch, item)` para cada item e grava em batches de até
+    `tamanho` operações. Retorna os itens dos batches que falharam, para quem
+    chama recolocar no acumulador; com propagar_erro, a exceção sobe.
+    """
+    falhas = []
+    for i in range(0, len(itens), tamanho):
+        parte = itens[i:i + tamanho]
+        batch = db.batch()
+        for item in parte:
+            aplicar(batch, item)
+        try:
+            batch.commit()
+        except Exception as e:
+            if propagar_erro:
+                raise
+            print(f"❌ Erro ao gravar batch de {len(parte)} operações: {e}")
+            falhas.extend(parte)
+    return falhas
+
+
+# 🔒 Jobs em segundo plano: reivindicados por transação, com dono e tempo de abandono
+TEMPO_ABANDONO = timedelta(minutes=5)
+
+
+def dono_processo() -> str:
+    """Identifica o worker que pegou o job (host:pid)."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def abandonado(job: dict, tempo: timedelta = TEMPO_ABANDONO, agora: datetime | None = None) -> bool:
+    """Job pendente/executando sem atualização há mais de `tempo` (o worker dono morreu)."""
+    atualizado_em = job.get("atualizado_em")
+    agora = agora or datetime.now(timezone.utc)
+    return (
+        job.get("status") in ("pendente", "executando")
+        and atualizado_em is not None
+        and agora - atualizado_em > tempo
+    )
+
+
+def reivindicar(db, ref, decidir):
+    """
+    Lê o documento do job numa transação e retorna `decidir(transacao, job, agora)`,
+    que grava na transação o que mudar (job é {} se o documento não existe).
+    """
+
+    @firestore.transactional
+    def _executar(transacao):
+        doc = ref.get(transaction=transacao)
+        return decidir(transacao, doc.to_dict() if doc.exists else {}, datetime.now(timezone.utc))
+
+    return _executar(db.transaction())
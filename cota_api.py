@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import atexit
+import os
+import threading
+import time
+from datetime import datetime
+
+from firebase_admin import firestore
+
+from consultas import gravar_em_batches
+from rollups_cliques import FUSO
+
+# api_contador/{uid}: requisições à API da Shopee no dia (horário de São Paulo)
+#   { data, uso_afiliado, uso_base }
+# uso_afiliado: buscas feitas pelo usuário; uso_base: atualização automática das buscas salvas
+COLECAO_CONTADOR = "api_contador"
+CAMPOS = {"afiliado": "uso_afiliado", "base": "uso_base"}
+LIMITE_DIARIO = 25000
+
+
+def hoje() -> str:
+    return datetime.now(FUSO).date().isoformat()
+
+
+class CotaApi:
+    """
+    Cota diária de requisições por uid como um balde de fichas em memória.
+    reservar() decide localmente quantas fichas liberar; o consumo é gravado
+    com Increment em batches por descarregar() (chamado pelo agendador).
+
+    Cada worker reconcilia o uid com o Firestore (grava o que tem pendente e
+    relê o total) quando o dia vira, a cada `intervalo_sync` segundos ou
+    antes de liberar mais que `margem` fichas desde a última leitura. Assim
+    cada worker só concede no escuro até `margem` fichas, e o excesso sobre o
+    limite fica em no máximo (workers - 1) * margem.
+
+    O que descarregar() está gravando fica em `em_voo` até o commit terminar e
+    continua contado em desde_sync depois de uma releitura feita nesse meio
+    tempo, que pode não ter visto o Increment ainda.
+    """
+
+    def __init__(self, db, limite: int = LIMITE_DIARIO, margem: int = 50, intervalo_sync: float = 60.0):
+        self.db = db
+        self.limite = limite
+        self.margem = margem
+        self.intervalo_sync = intervalo_sync
+        # uid -> {data, sincronizado_em, afiliado: {remoto, desde_sync, pendente, em_voo}, base: {...}}
+        self._estados: dict = {}
+        self._locks: dict = {}
+        self._lock = threading.Lock()
+        self.sincronizacoes = 0
+        atexit.register(self.descarregar)
+
+    @classmethod
+    def do_ambiente(cls, db) -> "CotaApi":
+        return cls(
+            db,
+            limite=int(os.getenv("COTA_DIARIA_SHOPEE", str(LIMITE_DIARIO))),
+            margem=int(os.getenv("COTA_MARGEM", "50")),
+            intervalo_sync=float(os.getenv("COTA_INTERVALO_SYNC", "60"))
+        )
+
+    def _ref(self, uid: str):
+        return self.db.collection(COLECAO_CONTADOR).document(uid)
+
+    def _lock_uid(self, uid: str) -> threading.Lock:
+        with self._lock:
+            if uid not in self._locks:
+                self._locks[uid] = threading.Lock()
+                self._estados[uid] = {
+                    "data": None,
+                    "sincronizado_em": 0.0,
+                    **{tipo: {"remoto": 0, "desde_sync": 0, "pendente": 0, "em_voo": 0} for tipo in CAMPOS}
+                }
+            return self._locks[uid]
+
+    def _virar_dia(self, dia: str, ref) -> dict:
+        """Zera o contador do dia anterior numa transação (só um worker efetivamente zera)."""
+
+        @firestore.transactional
+        def _executar(transacao):
+            doc = ref.get(transaction=transacao)
+            dados = doc.to_dict() if doc.exists else {}
+            if dados.get("data") == dia:
+                return dados
+            dados = {"data": dia, **{campo: 0 for campo in CAMPOS.values()}}
+            transacao.set(ref, dados)
+            return dados
+
+        return _executar(self.db.transaction())
+
+    def _sincronizar(self, uid: str, estado: dict):
+        """Grava o pendente do uid e relê o total do dia. Chamado com o lock do uid."""
+        dia, ref = hoje(), self._ref(uid)
+        mesmo_dia = estado["data"] == dia
+        if mesmo_dia:
+            incrementos = {CAMPOS[t]: firestore.Increment(estado[t]["pendente"]) for t in CAMPOS if estado[t]["pendente"]}
+            if incrementos:
+                ref.set(incrementos, merge=True)
+        elif any(estado[t]["pendente"] for t in CAMPOS):
+            # Consumo do dia anterior: a cota já virou, não há o que descontar
+            print(f"🔁 Cota de {uid}: descartando consumo pendente de {estado['data']}")
+
+        doc = ref.get()
+        dados = doc.to_dict() if doc.exists else {}
+        if dados.get("data") != dia:
+            dados = self._virar_dia(dia, ref)
+
+        for tipo, campo in CAMPOS.items():
+            # O Increment em voo talvez ainda não esteja no total lido: continua contado localmente
+            em_voo = estado[tipo]["em_voo"]
+            estado[tipo] = {"remoto": int(dados.get(campo) or 0), "desde_sync": em_voo if mesmo_dia else 0,
+                            "pendente": 0, "em_voo": em_voo}
+        estado["data"] = dia
+        estado["sincronizado_em"] = time.monotonic()
+        self.sincronizacoes += 1
+
+    def reservar(self, uid: str, tipo: str, quantidade: int) -> int:
+        """Libera até `quantidade` fichas da cota do dia; retorna quantas (0 se esgotou)."""
+        with self._lock_uid(uid):
+            estado = self._estados[uid]
+            saldo = estado[tipo]
+            if (estado["data"] != hoje()
+                    or time.monotonic() - estado["sincronizado_em"] > self.intervalo_sync
+                    or saldo["desde_sync"] + quantidade > self.margem):
+                self._sincronizar(uid, estado)
+                saldo = estado[tipo]
+            concedido = max(0, min(quantidade, self.limite - saldo["remoto"] - saldo["desde_sync"]))
+            saldo["desde_sync"] += concedido
+            saldo["pendente"] += concedido
+            return concedido
+
+    def devolver(self, uid: str, tipo: str, quantidade: int):
+        """Devolve fichas reservadas e não usadas (páginas que vieram do cache)."""
+        if quantidade <= 0:
+            return
+        with self._lock_uid(uid):
+            saldo = self._estados[uid][tipo]
+            saldo["desde_sync"] -= quantidade
+            saldo["pendente"] -= quantidade
+
+    def descarregar(self):
+        """Grava o consumo pendente de todos os uids com Increment, em batches de até 500."""
+        dia = hoje()
+        with self._lock:
+            uids = list(self._estados)
+
+        pendentes = []
+        for uid in uids:
+            with self._lock_uid(uid):
+                estado = self._estados[uid]
+                if estado["data"] != dia:
+                    continue
+                incrementos = {t: estado[t]["pendente"] for t in CAMPOS if estado[t]["pendente"]}
+                for tipo, n in incrementos.items():
+                    estado[tipo]["pendente"] = 0
+                    estado[tipo]["em_voo"] += n
+            if incrementos:
+                pendentes.append((uid, incrementos))
+
+        falhas = gravar_em_batches(self.db, pendentes, lambda batch, item: batch.set(
+            self._ref(item[0]), {CAMPOS[t]: firestore.Increment(n) for t, n in item[1].items()}, merge=True
+        ))
+        falharam = {uid for uid, _ in falhas}
+        for uid, incrementos in pendentes:
+            with self._lock_uid(uid):
+                estado = self._estados[uid]
+                for tipo, n in incrementos.items():
+                    estado[tipo]["em_voo"] -= n
+                    # Volta para o pendente e tenta de novo no próximo descarregamento
+                    if uid in falharam and estado["data"] == dia:
+                        estado[tipo]["pendente"] += n
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            estados = list(self._estados.values())
+        return {
+            "uids": len(estados),
+            "sincronizacoes": self.sincronizacoes,
+            "pendentes": sum(abs(e[t]["pendente"]) for e in estados for t in CAMPOS)
+        }
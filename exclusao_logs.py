@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from consultas import MAX_OPERACOES_BATCH, abandonado, dono_processo, reivindicar
+from rollups_cliques import AgregadorRollups, incremento, para_fuso
+
+# exclusoes_logs/{link_id}: exclusão dos logs de um link em segundo plano
+#   { uid, slug, status, fase, excluidos, excluido_em, executar_apos, dono, criado_em, atualizado_em, erro }
+# status: pendente -> executando -> concluida | erro
+# fase: "link_id" (logs gravados com o link_id) -> "legado" (logs antigos, só com uid/slug)
+COLECAO_EXCLUSOES = "exclusoes_logs"
+# Cada página vai num batch só: um delete por log + um desconto por documento de dia nos rollups
+TAMANHO_PAGINA = MAX_OPERACOES_BATCH // 2
+
+
+class ExclusaoLogs:
+    """
+    Apaga os logs_cliques de um link excluído em páginas de 250, fora do
+    request. A fase e o progresso ficam no documento do job, então o trabalho
+    é retomado de onde parou se o worker morrer. Os cliques apagados são
+    descontados dos rollups no mesmo batch dos deletes.
+
+    Os logs são apagados pelo link_id; os antigos, gravados sem link_id, por
+    uid + slug com data até a exclusão, para não pegar os cliques de um link
+    novo criado depois com o mesmo slug. Os outros workers (e o redirect_app)
+    ainda servem o slug pelo cache local até o TTL dele expirar, então o job
+    só começa `atraso` segundos depois da exclusão, quando esses últimos
+    cliques já foram gravados.
+    """
+
+    def __init__(self, db, ao_concluir=None, max_jobs: int = 2, atraso: float = 90.0):
+        self.db = db
+        self.ao_concluir = ao_concluir
+        self.atraso = atraso
+        self.executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="exclusao-logs")
+        self.dono = dono_processo()
+
+    def _ref(self, job_id: str):
+        return self.db.collection(COLECAO_EXCLUSOES).document(job_id)
+
+    def agendar(self, link_id: str, uid: str, slug: str) -> str:
+        agora = datetime.now(timezone.utc)
+        self._ref(link_id).set({
+            "uid": uid,
+            "slug": slug,
+            "status": "pendente",
+            "fase": "link_id",
+            "excluidos": 0,
+            "excluido_em": agora,
+            "executar_apos": agora + timedelta(seconds=self.atraso),
+            "dono": None,
+            "criado_em": agora,
+            "atualizado_em": agora,
+            "erro": None
+        })
+        timer = threading.Timer(self.atraso, self.executor.submit, args=(self.executar, link_id))
+        timer.daemon = True
+        timer.start()
+        return link_id
+
+    def status(self, job_id: str) -> dict | None:
+        doc = self._ref(job_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def _reivindicar(self, job_id: str) -> dict | None:
+        """Marca o job como deste worker, se estiver livre (e no horário) ou abandonado."""
+        ref = self._ref(job_id)
+
+        def decidir(transacao, job, agora):
+            if not job:
+                return None
+            no_horario = job.get("executar_apos") is None or agora >= job["executar_apos"]
+            livre = job.get("status") == "pendente" and no_horario
+            if not livre and not (job.get("status") == "executando" and abandonado(job, agora=agora)):
+                return None
+            transacao.update(ref, {"status": "executando", "dono": self.dono, "atualizado_em": agora})
+            return job
+
+        return reivindicar(self.db, ref, decidir)
+
+    def _query(self, job_id: str, job: dict, fase: str):
+        logs = self.db.collection("logs_cliques")
+        if fase == "link_id":
+            query = logs.where("link_id", "==", job_id)
+        else:
+            # Jobs criados antes do excluido_em usam criado_em como limite
+            limite = job.get("excluido_em") or job.get("criado_em")
+            query = logs.where("uid", "==", job["uid"]).where("slug", "==", job["slug"]).where("data", "<=", limite)
+        # Os documentos da página são apagados, então a próxima consulta já começa depois deles
+        return query.select(["data"]).limit(TAMANHO_PAGINA)
+
+    def executar(self, job_id: str):
+        try:
+            job = self._reivindicar(job_id)
+        except Exception as e:
+            print(f"Erro ao reivindicar exclusão de logs {job_id}: {e}")
+            return
+        if job is None:
+            return
+
+        uid, slug = job["uid"], job["slug"]
+        excluidos = job.get("excluidos", 0)
+        fases = ["link_id", "legado"]
+        fases = fases[fases.index(job.get("fase") or "link_id"):]
+        ref = self._ref(job_id)
+
+        try:
+            for fase in fases:
+                while True:
+                    pagina = list(self._query(job_id, job, fase).stream())
+                    if not pagina:
+                        break
+
+                    batch = self.db.batch()
+                    rollups = AgregadorRollups()
+                    for doc in pagina:
+                        batch.delete(doc.reference)
+                        data = doc.to_dict().get("data")
+                        if data:
+                            dt = para_fuso(data)
+                            rollups.somar(uid, dt.date().isoformat(), dt.hour, slug, quantidade=-1)
+                    for chave, delta in rollups.retirar().items():
+                        batch.set(*incremento(self.db, chave, delta), merge=True)
+                    batch.commit()
+
+                    excluidos += len(pagina)
+                    ref.update({"fase": fase, "excluidos": excluidos, "atualizado_em": datetime.now(timezone.utc)})
+                    print(f"🗑️ Exclusão de logs de '{slug}': {excluidos} excluídos")
+                if fase != fases[-1]:
+                    ref.update({"fase": fases[fases.index(fase) + 1], "atualizado_em": datetime.now(timezone.utc)})
+
+            ref.update({"status": "concluida", "atualizado_em": datetime.now(timezone.utc)})
+        except Exception as e:
+            print(f"❌ Erro na exclusão de logs de '{slug}' ({job_id}): {e}")
+            ref.update({"status": "erro", "erro": str(e), "atualizado_em": datetime.now(timezone.utc)})
+            return
+
+        if self.ao_concluir:
+            self.ao_concluir(uid)
+
+    def retomar_pendentes(self) -> int:
+        """Reenvia ao executor os jobs pendentes ou abandonados (rodado pelo agendador)."""
+        total = 0
+        query = self.db.collection(COLECAO_EXCLUSOES).where("status", "in", ["pendente", "executando"])
+        for doc in query.select(["status"]).stream():
+            self.executor.submit(self.executar, doc.id)
+            total += 1
+        return total
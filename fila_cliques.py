@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import atexit
+import os
+import queue
+import threading
+import time
+from collections import Counter
+
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+
+from consultas import MAX_OPERACOES_BATCH, gravar_em_batches
+
+# Tentativas de gravar um lote de logs, com espera exponencial (0.5s, 1s, ...) entre elas
+TENTATIVAS_LOTE = 3
+BACKOFF_LOTE = 0.5
+
+
+class ContadorCliques:
+    """
+    Soma os cliques de cada link em memória para gravar um único
+    Increment(n) por link a cada intervalo, em vez de um por clique.
+    """
+
+    def __init__(self):
+        self._pendentes: Counter = Counter()
+        self._lock = threading.Lock()
+        self.incrementos_gravados = 0
+
+    def registrar(self, link_id: str, log: dict):
+        self.somar(link_id)
+
+    def somar(self, link_id: str, quantidade: int = 1):
+        with self._lock:
+            self._pendentes[link_id] += quantidade
+
+    def retirar(self) -> dict:
+        """Retorna os incrementos acumulados e zera o acumulador."""
+        with self._lock:
+            pendentes, self._pendentes = self._pendentes, Counter()
+        return dict(pendentes)
+
+    def descarregar(self, db):
+        pendentes = list(self.retirar().items())
+        falhas = gravar_em_batches(db, pendentes, lambda batch, item: batch.update(
+            db.collection("links_encurtados").document(item[0]),
+            {"cliques": firestore.Increment(item[1])}
+        ))
+        self.incrementos_gravados += len(pendentes) - len(falhas)
+
+        # Um link excluído faz o batch inteiro falhar: grava um a um
+        for link_id, quantidade in falhas:
+            try:
+                db.collection("links_encurtados").document(link_id).update(
+                    {"cliques": firestore.Increment(quantidade)}
+                )
+                self.incrementos_gravados += 1
+            except NotFound:
+                print(f"🗑️ Link {link_id} não existe mais, descartando {quantidade} clique(s)")
+            except Exception as e:
+                # Erro transitório: volta para o acumulador e tenta no próximo descarregamento
+                print(f"❌ Erro ao incrementar cliques de {link_id}: {e}")
+                self.somar(link_id, quantidade)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pendentes)
+
+
+class FilaCliques:
+    """
+    Fila limitada de eventos de clique, descarregada por uma thread em segundo plano
+    com batches do Firestore. O redirecionamento só enfileira e retorna.
+
+    Os logs vão para logs_cliques em batches de até 500 documentos; os
+    incrementos de links_encurtados/{link_id}.cliques são agregados pelo
+    ContadorCliques e gravados a cada `intervalo_contadores` segundos.
+
+    Outros agregadores (objetos com registrar(link_id, log) e descarregar(db))
+    podem ser passados em `agregadores` e seguem o mesmo ciclo do contador.
+    """
+
+    def __init__(self, db, tamanho_max: int = 10000, tamanho_lote: int = 500, intervalo: float = 2.0,
+                 intervalo_contadores: float = 5.0, agregadores: list | None = None):
+        self.db = db
+        self.tamanho_lote = max(1, min(tamanho_lote, MAX_OPERACOES_BATCH))
+        self.intervalo = intervalo
+        self.intervalo_contadores = intervalo_contadores
+        self.contador = ContadorCliques()
+        self.agregadores = [self.contador, *(agregadores or [])]
+        self._ultimos_contadores = time.monotonic()
+        self._fila: queue.Queue = queue.Queue(maxsize=tamanho_max)
+        self._parar = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.enfileirados = 0
+        self.gravados = 0
+        self.gravados_sincronos = 0
+        self.lotes = 0
+        self.erros = 0
+        atexit.register(self.parar)
+
+    def enfileirar(self, link_id: str, log: dict):
+        """Enfileira um clique. Se a fila estiver cheia, grava direto (backpressure)."""
+        self._garantir_thread()
+        evento = {"link_id": link_id, "log": log}
+        for agregador in self.agregadores:
+            agregador.registrar(link_id, log)
+        try:
+            self._fila.put_nowait(evento)
+            self.enfileirados += 1
+        except queue.Full:
+            self._gravar([evento])
+            self.gravados_sincronos += 1
+
+    def _garantir_thread(self):
+        # Inicia a thread no próprio processo (gunicorn faz fork dos workers)
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._parar.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._executar, name="fila-cliques", daemon=True)
+            self._thread.start()
+
+    def _executar(self):
+        while not self._parar.is_set():
+            lote = self._coletar_lote()
+            if lote:
+                self._gravar(lote)
+            if time.monotonic() - self._ultimos_contadores >= self.intervalo_contadores:
+                self._descarregar_agregadores()
+        # Drena o que sobrou antes de encerrar
+        while True:
+            lote = self._coletar_lote(bloquear=False)
+            if not lote:
+                break
+            self._gravar(lote)
+        self._descarregar_agregadores()
+
+    def _coletar_lote(self, bloquear: bool = True) -> list:
+        lote = []
+        limite = time.monotonic() + self.intervalo
+        while len(lote) < self.tamanho_lote:
+            restante = limite - time.monotonic()
+            try:
+                if bloquear and restante > 0 and not self._parar.is_set():
+                    lote.append(self._fila.get(timeout=restante))
+                else:
+                    lote.append(self._fila.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _gravar(self, eventos: list):
+        batch = self.db.batch()
+        for evento in eventos:
+            batch.set(self.db.collection("logs_cliques").document(), evento["log"])
+        for tentativa in range(TENTATIVAS_LOTE):
+            if tentativa:
+                time.sleep(BACKOFF_LOTE * (2 ** (tentativa - 1)))
+            try:
+                batch.commit()
+                self.lotes += 1
+                self.gravados += len(eventos)
+                return
+            except Exception as e:
+                print(f"❌ Erro ao gravar lote de cliques (tentativa {tentativa + 1}): {e}")
+
+        # O lote falhou em todas as tentativas: grava evento a evento para não perder o lote inteiro
+        for evento in eventos:
+            try:
+                self.db.collection("logs_cliques").add(evento["log"])
+                self.gravados += 1
+            except Exception as e:
+                self.erros += 1
+                print(f"❌ Erro ao gravar clique de {evento['link_id']}: {e}")
+
+    def _descarregar_agregadores(self):
+        self._ultimos_contadores = time.monotonic()
+        for agregador in self.agregadores:
+            try:
+                agregador.descarregar(self.db)
+            except Exception as e:
+                print(f"❌ Erro ao descarregar {type(agregador).__name__}: {e}")
+
+    def parar(self, timeout: float = 10.0):
+        """Sinaliza a thread e aguarda a fila ser drenada (chamado no encerramento do worker)."""
+        self._parar.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+
+    def estatisticas(self) -> dict:
+        return {
+            "pendentes": self._fila.qsize(),
+            "enfileirados": self.enfileirados,
+            "gravados": self.gravados,
+            "gravados_sincronos": self.gravados_sincronos,
+            "lotes": self.lotes,
+            "erros": self.erros,
+            "contadores_pendentes": len(self.contador),
+            "incrementos_gravados": self.contador.incrementos_gravados,
+            "tamanho_lote": self.tamanho_lote,
+            "intervalo": self.intervalo,
+            "intervalo_contadores": self.intervalo_contadores,
+        }
@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+import base64
+import json
+import os
+
+import firebase_admin
+from dotenv import load_dotenv
+from firebase_admin import credentials
+from firebase_admin import firestore
+
+
+def inicializar_firebase():
+    """
+    Inicializa o Firebase Admin com a chave em FIREBASE_KEY_B64 (.env) e
+    retorna o cliente do Firestore. Pode ser chamada mais de uma vez.
+    """
+    load_dotenv()
+    try:
+        firebase_admin.get_app()
+    except ValueError:
+        firebase_b64 = os.getenv("FIREBASE_KEY_B64")
+        if not firebase_b64:
+            raise ValueError("FIREBASE_KEY_B64 não configurado no .env")
+        cred = credentials.Certificate(json.loads(base64.b64decode(firebase_b64)))
+        firebase_admin.initialize_app(cred)
+    return firestore.client()
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import csv
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import indice_slugs
+from consultas import MAX_OPERACOES_BATCH, executar_em_paralelo
+
+# 📥 Importação de links em massa (CSV ou JSON com slug, url, tipo, modo)
+LINKS_POR_BATCH = MAX_OPERACOES_BATCH // 2  # links_encurtados/{id} + slugs/{slug}
+TAMANHO_GET_ALL = 500
+TAMANHO_FILTRO_IN = 30
+MODOS = ("direto", "camuflado")
+TIPOS = ("grupo", "produto", "contador", "outro")
+# Nomes alternativos aceitos no formulário e na importação
+APELIDOS_TIPO = {"whatsapp": "grupo"}
+
+# Pool próprio e pequeno: uma importação grande não ocupa o pool de consultas do /painel
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("IMPORTACAO_THREADS", "2")),
+    thread_name_prefix="importacao"
+)
+
+
+def ler_linhas(conteudo: str, formato: str) -> list[dict]:
+    """Converte o CSV (com cabeçalho) ou o JSON (lista de objetos) em linhas."""
+    if formato == "json":
+        linhas = json.loads(conteudo)
+        if isinstance(linhas, dict):
+            linhas = linhas.get("links", [])
+        if not isinstance(linhas, list):
+            raise ValueError("O JSON deve ser uma lista de links")
+        return [l if isinstance(l, dict) else {} for l in linhas]
+    return list(csv.DictReader(io.StringIO(conteudo.lstrip("\ufeff"))))
+
+
+def normalizar_tipo(tipo) -> str:
+    tipo = str(tipo or "").strip().lower()
+    return APELIDOS_TIPO.get(tipo, tipo)
+
+
+def _validar(linha: dict, categorizar) -> tuple[dict | None, str | None]:
+    slug = str(linha.get("slug") or "").strip()
+    url = str(linha.get("url") or linha.get("url_destino") or "").strip()
+    modo = str(linha.get("modo") or "direto").strip().lower()
+    tipo = normalizar_tipo(linha.get("tipo"))
+
+    if not indice_slugs.slug_valido(slug):
+        return None, "slug inválido"
+    if not url.startswith(("http://", "https://")):
+        return None, "url inválida"
+    if modo not in MODOS:
+        return None, f"modo inválido: {modo}"
+    if tipo and tipo not in TIPOS:
+        return None, f"tipo inválido: {tipo}"
+
+    return {
+        "slug": slug,
+        "url_destino": url,
+        "categoria": tipo or categorizar(url),
+        "categoria_manual": bool(tipo),
+        "modo": modo
+    }, None
+
+
+def _slugs_indexados(db, slugs: list[str]) -> set[str]:
+    """Slugs já reservados em slugs/{slug}, com get_all em blocos disparados em paralelo."""
+    blocos = [slugs[i:i + TAMANHO_GET_ALL] for i in range(0, len(slugs), TAMANHO_GET_ALL)]
+
+    def buscar(bloco):
+        refs = [db.collection(indice_slugs.COLECAO_SLUGS).document(s) for s in bloco]
+        return {d.id for d in db.get_all(refs) if d.exists}
+
+    tarefas = {i: (lambda b=bloco: buscar(b), None, 30.0) for i, bloco in enumerate(blocos)}
+    existentes = set()
+    for i, resultado in executar_em_paralelo(tarefas, executor=_executor, tempo_da_execucao=True).items():
+        if resultado is None:
+            # Sem confirmação de que estão livres: trata o bloco todo como ocupado
+            existentes.update(blocos[i])
+        else:
+            existentes.update(resultado)
+    return existentes
+
+
+def _slugs_legados(db, slugs: list[str]) -> set[str]:
+    """Slugs usados por links ainda não migrados para o índice (filtro `in` em blocos de 30)."""
+    blocos = [slugs[i:i + TAMANHO_FILTRO_IN] for i in range(0, len(slugs), TAMANHO_FILTRO_IN)]
+
+    def buscar(bloco):
+        query = db.collection(indice_slugs.COLECAO_LINKS).where("slug", "in", bloco).select(["slug"])
+        return {d.to_dict().get("slug") for d in query.stream()}
+
+    tarefas = {i: (lambda b=bloco: buscar(b), None, 30.0) for i, bloco in enumerate(blocos)}
+    existentes = set()
+    for i, resultado in executar_em_paralelo(tarefas, executor=_executor, tempo_da_execucao=True).items():
+        existentes.update(blocos[i] if resultado is None else resultado)
+    return existentes
+
+
+def _gravar_bloco(db, itens: list[tuple[int, dict]]) -> dict:
+    """
+    Grava até 250 links (link + slug) num batch. O slug usa create(), então se
+    outro request reservar um deles no meio do caminho o batch falha inteiro e
+    cada link é refeito na transação de indice_slugs.criar_link.
+    """
+    batch = db.batch()
+    ids = {}
+    for numero, dados in itens:
+        link_ref = db.collection(indice_slugs.COLECAO_LINKS).document()
+        batch.create(db.collection(indice_slugs.COLECAO_SLUGS).document(dados["slug"]),
+                     indice_slugs.dados_indice(link_ref.id, dados))
+        batch.create(link_ref, dados)
+        ids[numero] = link_ref.id
+
+    try:
+        batch.commit()
+        return {numero: (link_id, None) for numero, link_id in ids.items()}
+    except Exception as e:
+        print(f"⚠️ Batch de importação falhou ({e}), gravando link a link")
+
+    resultados = {}
+    for numero, dados in itens:
+        try:
+            resultados[numero] = (indice_slugs.criar_link(db, dados), None)
+        except indice_slugs.SlugEmUso:
+            resultados[numero] = (None, "slug já está em uso")
+        except Exception as e:
+            resultados[numero] = (None, f"erro ao gravar: {e}")
+    return resultados
+
+
+def importar(db, uid: str, linhas: list[dict], categorizar, verificar_legado: bool = False) -> dict:
+    """
+    Valida e cria os links em massa. Retorna {criados, erros, desconhecidos, resultados},
+    com uma entrada por linha: {linha, slug, status, id | erro}. status "desconhecido":
+    o batch passou do tempo e continua rodando, então o link pode ter sido criado.
+
+    categorizar(url) define a categoria quando a linha não traz `tipo`.
+    Com verificar_legado, também confere slugs de links fora do índice.
+    """
+    resultados = [None] * len(linhas)
+    validos = {}
+    vistos = set()
+    criado_em = datetime.now().isoformat()
+
+    for numero, linha in enumerate(linhas):
+        dados, erro = _validar(linha, categorizar)
+        if dados and dados["slug"] in vistos:
+            dados, erro = None, "slug repetido no arquivo"
+        if erro:
+            resultados[numero] = {"linha": numero + 1, "slug": linha.get("slug"), "status": "erro", "erro": erro}
+            continue
+        vistos.add(dados["slug"])
+        validos[numero] = {**dados, "uid": uid, "cliques": 0, "criado_em": criado_em}
+
+    slugs = [d["slug"] for d in validos.values()]
+    ocupados = _slugs_indexados(db, slugs)
+    if verificar_legado:
+        ocupados |= _slugs_legados(db, [s for s in slugs if s not in ocupados])
+
+    pendentes = []
+    for numero, dados in validos.items():
+        if dados["slug"] in ocupados:
+            resultados[numero] = {"linha": numero + 1, "slug": dados["slug"], "status": "erro",
+                                  "erro": "slug já está em uso"}
+        else:
+            pendentes.append((numero, dados))
+
+    # Batches independentes: gravados em paralelo no pool da importação
+    blocos = [pendentes[i:i + LINKS_POR_BATCH] for i in range(0, len(pendentes), LINKS_POR_BATCH)]
+    tarefas = {i: (lambda b=bloco: _gravar_bloco(db, b), None, 120.0) for i, bloco in enumerate(blocos)}
+    gravados = executar_em_paralelo(tarefas, executor=_executor, tempo_da_execucao=True)
+
+    criados = []
+    for i, bloco in enumerate(blocos):
+        resultado_bloco = gravados.get(i)
+        for numero, dados in bloco:
+            if resultado_bloco is None:
+                # cancel() não interrompe um batch já em execução: o link pode ter sido gravado
+                resultados[numero] = {"linha": numero + 1, "slug": dados["slug"], "status": "desconhecido",
+                                      "erro": "tempo esgotado ao gravar, confira se o link foi criado"}
+                continue
+            link_id, erro = resultado_bloco[numero]
+            if link_id:
+                criados.append(dados)
+                resultados[numero] = {"linha": numero + 1, "slug": dados["slug"], "status": "criado", "id": link_id}
+            else:
+                resultados[numero] = {"linha": numero + 1, "slug": dados["slug"], "status": "erro", "erro": erro}
+
+    return {
+        "criados": criados,
+        "erros": sum(1 for r in resultados if r["status"] == "erro"),
+        "desconhecidos": sum(1 for r in resultados if r["status"] == "desconhecido"),
+        "resultados": resultados
+    }
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import re
+import unicodedata
+from bisect import bisect_left
+
+# 🔎 Índice invertido em memória para filtrar produtos por palavras do título e da loja
+
+
+def normalizar(texto: str) -> str:
+    """Minúsculas e sem acentos: "Café" -> "cafe"."""
+    decomposto = unicodedata.normalize("NFKD", texto or "")
+    return "".join(c for c in decomposto if not unicodedata.combining(c)).lower()
+
+
+def tokens(texto: str) -> list[str]:
+    return re.findall(r"[a-z0-9]+", normalizar(texto))
+
+
+class IndiceInvertido:
+    """
+    token -> posições dos documentos que o contêm. A consulta exige todas as
+    palavras (AND) e cada uma vale como prefixo ("cam" encontra "camiseta"),
+    resolvido por busca binária na lista ordenada de tokens.
+    """
+
+    def __init__(self, documentos: list[str]):
+        self._posicoes: dict[str, set[int]] = {}
+        for posicao, texto in enumerate(documentos):
+            for token in tokens(texto):
+                self._posicoes.setdefault(token, set()).add(posicao)
+        self._tokens = sorted(self._posicoes)
+
+    def _com_prefixo(self, prefixo: str) -> set[int]:
+        encontrados = set()
+        i = bisect_left(self._tokens, prefixo)
+        while i < len(self._tokens) and self._tokens[i].startswith(prefixo):
+            encontrados |= self._posicoes[self._tokens[i]]
+            i += 1
+        return encontrados
+
+    def buscar(self, consulta: str) -> list[int] | None:
+        """Posições (em ordem) que casam com todas as palavras; None se a consulta não tem palavras."""
+        palavras = sorted(set(tokens(consulta)), key=len, reverse=True)
+        if not palavras:
+            return None
+        resultado = None
+        for palavra in palavras:
+            posicoes = self._com_prefixo(palavra)
+            resultado = posicoes if resultado is None else resultado & posicoes
+            if not resultado:
+                return []
+        return sorted(resultado)
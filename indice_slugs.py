@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+from firebase_admin import firestore
+
+# slugs/{slug} -> dados necessários para o redirecionamento (um único get por slug)
+COLECAO_SLUGS = "slugs"
+COLECAO_LINKS = "links_encurtados"
+# migracoes/slugs guarda o cursor da migração e se ela já terminou
+DOC_MIGRACAO = ("migracoes", "slugs")
+TAMANHO_PAGINA_MIGRACAO = 250
+
+
+class SlugEmUso(Exception):
+    pass
+
+
+def slug_valido(slug: str | None) -> bool:
+    """O slug vira id de documento: não pode ser vazio, ter '/', ser '.'/'..' nem ter a forma __x__."""
+    return bool(
+        slug
+        and "/" not in slug
+        and slug not in (".", "..")
+        and not (slug.startswith("__") and slug.endswith("__"))
+        and len(slug.encode()) <= 1500
+    )
+
+
+def dados_indice(link_id: str, dados: dict) -> dict:
+    """Campos do link copiados para slugs/{slug}."""
+    return {
+        "link_id": link_id,
+        "uid": dados.get("uid", ""),
+        "url_destino": dados.get("url_destino", "/"),
+        "modo": dados.get("modo", "direto"),
+        "categoria": dados.get("categoria", "")
+    }
+
+
+def obter(db, slug: str) -> dict | None:
+    if not slug_valido(slug):
+        return None
+    doc = db.collection(COLECAO_SLUGS).document(slug).get()
+    return doc.to_dict() if doc.exists else None
+
+
+def criar_link(db, dados: dict) -> str:
+    """
+    Cria links_encurtados/{id} e slugs/{slug} na mesma transação.
+    Lança SlugEmUso se o slug já estiver reservado.
+    """
+    slug = dados["slug"]
+    link_ref = db.collection(COLECAO_LINKS).document()
+    slug_ref = db.collection(COLECAO_SLUGS).document(slug)
+
+    @firestore.transactional
+    def _criar(transacao):
+        if slug_ref.get(transaction=transacao).exists:
+            raise SlugEmUso(slug)
+        transacao.create(slug_ref, dados_indice(link_ref.id, dados))
+        transacao.create(link_ref, dados)
+
+    _criar(db.transaction())
+    return link_ref.id
+
+
+def atualizar_link(db, link_id: str, slug_antigo: str, dados: dict):
+    """
+    Atualiza o link e o índice. Se o slug mudou, reserva o novo e libera o antigo
+    na mesma transação. Lança SlugEmUso se o novo slug pertencer a outro link.
+    """
+    link_ref = db.collection(COLECAO_LINKS).document(link_id)
+    novo_ref = db.collection(COLECAO_SLUGS).document(dados["slug"])
+    mudou = slug_antigo != dados["slug"] and slug_valido(slug_antigo)
+    antigo_ref = db.collection(COLECAO_SLUGS).document(slug_antigo) if mudou else None
+
+    @firestore.transactional
+    def _atualizar(transacao):
+        link_doc = link_ref.get(transaction=transacao)
+        novo = novo_ref.get(transaction=transacao)
+        antigo = antigo_ref.get(transaction=transacao) if antigo_ref is not None else None
+        if novo.exists and novo.to_dict().get("link_id") != link_id:
+            raise SlugEmUso(dados["slug"])
+        atual = link_doc.to_dict() or {}
+        atual.update(dados)
+        transacao.update(link_ref, dados)
+        transacao.set(novo_ref, dados_indice(link_id, atual))
+        # Só libera o slug antigo se ele estava indexado para este link
+        if antigo is not None and antigo.exists and antigo.to_dict().get("link_id") == link_id:
+            transacao.delete(antigo_ref)
+
+    _atualizar(db.transaction())
+
+
+def remover(batch, db, slug: str):
+    if slug_valido(slug):
+        batch.delete(db.collection(COLECAO_SLUGS).document(slug))
+
+
+def donos(db, slugs: list[str]) -> dict:
+    """slug -> link_id dos slugs já indexados (um get_all)."""
+    refs = [db.collection(COLECAO_SLUGS).document(s) for s in dict.fromkeys(slugs) if slug_valido(s)]
+    if not refs:
+        return {}
+    return {d.id: d.to_dict().get("link_id") for d in db.get_all(refs, field_paths=["link_id"]) if d.exists}
+
+
+def sincronizar(batch, db, link_id: str, dados: dict, indexados: dict | None = None) -> bool:
+    """
+    Reescreve slugs/{slug} a partir dos dados atuais do link (batch ou transação).
+    Não mexe no slug indexado para outro link (links legados com slug repetido);
+    `indexados` é o resultado de donos() quando quem chama já buscou os slugs da página.
+    """
+    slug = dados.get("slug")
+    if not slug_valido(slug):
+        return False
+    if indexados is None:
+        indexados = donos(db, [slug])
+    if indexados.get(slug, link_id) != link_id:
+        print(f"⚠️ Slug '{slug}' indexado para outro link ({indexados[slug]}), ignorando {link_id}")
+        return False
+    batch.set(db.collection(COLECAO_SLUGS).document(slug), dados_indice(link_id, dados))
+    return True
+
+
+def migracao_concluida(db) -> bool:
+    doc = db.collection(DOC_MIGRACAO[0]).document(DOC_MIGRACAO[1]).get()
+    return bool(doc.exists and doc.to_dict().get("concluida"))
+
+
+def migrar(db, tamanho_pagina: int = TAMANHO_PAGINA_MIGRACAO) -> dict:
+    """
+    Preenche slugs/{slug} para os links existentes, em páginas ordenadas pelo id
+    do documento. O cursor é gravado no mesmo batch da página, então a migração
+    pode ser interrompida e retomada de onde parou.
+    """
+    colecao = db.collection(COLECAO_LINKS)
+    controle_ref = db.collection(DOC_MIGRACAO[0]).document(DOC_MIGRACAO[1])
+    controle_doc = controle_ref.get()
+    controle = controle_doc.to_dict() if controle_doc.exists else {}
+    cursor = controle.get("cursor")
+    migrados = controle.get("migrados", 0)
+    conflitos = controle.get("conflitos", 0)
+
+    while True:
+        query = colecao.order_by(firestore.FieldPath.document_id()).limit(tamanho_pagina)
+        if cursor:
+            query = query.where(firestore.FieldPath.document_id(), ">", colecao.document(cursor))
+        pagina = list(query.stream())
+        if not pagina:
+            break
+
+        por_slug = {}
+        for doc in pagina:
+            slug = (doc.to_dict().get("slug") or "").strip()
+            if slug_valido(slug):
+                por_slug.setdefault(slug, doc)
+
+        refs = [db.collection(COLECAO_SLUGS).document(s) for s in por_slug]
+        existentes = {d.id: d.to_dict() for d in db.get_all(refs) if d.exists}
+
+        batch = db.batch()
+        for slug, doc in por_slug.items():
+            atual = existentes.get(slug)
+            if atual and atual.get("link_id") != doc.id:
+                conflitos += 1
+                print(f"⚠️ Slug '{slug}' já indexado para outro link ({atual.get('link_id')}), ignorando {doc.id}")
+                continue
+            batch.set(db.collection(COLECAO_SLUGS).document(slug), dados_indice(doc.id, doc.to_dict()))
+            migrados += 1
+
+        cursor = pagina[-1].id
+        batch.set(controle_ref, {
+            "cursor": cursor,
+            "migrados": migrados,
+            "conflitos": conflitos,
+            "concluida": False
+        }, merge=True)
+        batch.commit()
+        print(f"🔁 Migração de slugs: {migrados} migrados, {conflitos} conflitos (cursor {cursor})")
+
+    controle_ref.set({"concluida": True, "migrados": migrados, "conflitos": conflitos}, merge=True)
+    return {"migrados": migrados, "conflitos": conflitos}
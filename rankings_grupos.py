@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import heapq
+import threading
+import time
+from datetime import datetime
+
+METRICAS = ("cliques", "conversao", "entradas")
+
+
+def montar_grupo(slug: str, cliques: int, entradas: int, criado_em=None) -> dict:
+    conversao = round((entradas / cliques) * 100, 2) if cliques > 0 else 0
+
+    # Etiquetas visuais
+    etiquetas = []
+    if conversao >= 70:
+        etiquetas.append("🟢 Alta Conversão")
+    if cliques < 10:
+        etiquetas.append("🟡 Baixo Tráfego")
+    if entradas == 0:
+        etiquetas.append("🔴 Sem Entrada")
+
+    return {
+        "slug": slug,
+        "cliques": cliques,
+        "entradas": entradas,
+        "conversao": conversao,
+        "etiquetas": etiquetas,
+        "criado_em": criado_em
+    }
+
+
+def recomendacoes_do_grupo(g: dict) -> list[str]:
+    recomendacoes = []
+    if g["conversao"] >= 80 and g["cliques"] >= 30:
+        recomendacoes.append(f"🔥 O grupo *{g['slug']}* está com alta conversão ({g['conversao']}%)")
+    if g["cliques"] >= 50 and g["entradas"] == 0:
+        recomendacoes.append(f"⚠️ O grupo *{g['slug']}* teve muitos cliques mas nenhuma entrada.")
+    if g["cliques"] <= 5:
+        recomendacoes.append(f"📉 O grupo *{g['slug']}* teve poucos cliques. Avalie sua divulgação.")
+    return recomendacoes
+
+
+def data_criacao(criado_em):
+    if isinstance(criado_em, str):
+        return datetime.fromisoformat(criado_em.replace("Z", ""))
+    return criado_em
+
+
+def criado_na_janela(g: dict, data_limite: datetime | None) -> bool:
+    if not data_limite:
+        return True
+    try:
+        return g["criado_em"] >= data_limite
+    except TypeError:
+        return False
+
+
+class EstadoGrupos:
+    """Grupos de um uid/tipo com o top-k de cada métrica e as recomendações já calculados."""
+
+    def __init__(self, grupos: dict, k: int):
+        self.k = k
+        self.grupos = grupos
+        self.recomendacoes = {slug: recomendacoes_do_grupo(g) for slug, g in grupos.items()}
+        self.top = {m: self._calcular_top(m) for m in METRICAS}
+        self.carregado_em = time.monotonic()
+
+    def _calcular_top(self, metrica: str) -> list[str]:
+        return [g["slug"] for g in heapq.nlargest(self.k, self.grupos.values(), key=lambda g: g[metrica])]
+
+    def _atualizar_top(self, metrica: str, slug: str, anterior: dict):
+        top = self.top[metrica]
+        valor = self.grupos[slug][metrica]
+        if slug in top:
+            if valor >= anterior[metrica]:
+                top.sort(key=lambda s: self.grupos[s][metrica], reverse=True)
+            else:
+                # Caiu de valor: outro grupo fora do top pode ter passado à frente
+                self.top[metrica] = self._calcular_top(metrica)
+        elif len(top) < self.k or valor > self.grupos[top[-1]][metrica]:
+            top.append(slug)
+            top.sort(key=lambda s: self.grupos[s][metrica], reverse=True)
+            del top[self.k:]
+
+    def aplicar(self, slug: str, cliques: int | None = None, entradas: int | None = None):
+        anterior = self.grupos.get(slug)
+        if anterior is None:
+            return
+        atualizado = montar_grupo(
+            slug,
+            anterior["cliques"] if cliques is None else cliques,
+            anterior["entradas"] if entradas is None else entradas,
+            anterior["criado_em"]
+        )
+        self.grupos[slug] = atualizado
+        self.recomendacoes[slug] = recomendacoes_do_grupo(atualizado)
+        for metrica in METRICAS:
+            if atualizado[metrica] != anterior[metrica]:
+                self._atualizar_top(metrica, slug, anterior)
+
+    def ranking(self, metrica: str) -> list[dict]:
+        return [self.grupos[s] for s in self.top[metrica]]
+
+
+class MotorGrupos:
+    """
+    Estatísticas de /grupos por usuário, mantidas em memória no worker.
+    Cliques (via FilaCliques) e entradas atualizam o estado e os top-k sem ir
+    ao Firestore; o estado é recarregado após `ttl` segundos para incorporar
+    cliques registrados por outros workers.
+    """
+
+    def __init__(self, db, k: int = 5, ttl: float = 60.0, max_usuarios: int = 2000):
+        self.db = db
+        self.k = k
+        self.ttl = ttl
+        self.max_usuarios = max_usuarios
+        self._estados: dict = {}
+        self._lock = threading.Lock()
+
+    def _carregar(self, uid: str, tipo: str) -> EstadoGrupos:
+        query = self.db.collection("links_encurtados").where("uid", "==", uid)
+        if tipo != "todos":
+            query = query.where("categoria", "==", tipo)
+        grupos = {}
+        for doc in query.select(["slug", "cliques", "entradas", "criado_em"]).stream():
+            dados = doc.to_dict()
+            slug = dados.get("slug")
+            try:
+                criado_em = data_criacao(dados.get("criado_em", ""))
+            except Exception:
+                continue
+            if not slug:
+                continue
+            grupos[slug] = montar_grupo(
+                slug, int(dados.get("cliques", 0)), int(dados.get("entradas", 0)), criado_em
+            )
+        return EstadoGrupos(grupos, self.k)
+
+    def obter(self, uid: str, tipo: str) -> EstadoGrupos:
+        chave = (uid, tipo)
+        with self._lock:
+            estado = self._estados.get(chave)
+            if estado and time.monotonic() - estado.carregado_em < self.ttl:
+                return estado
+        estado = self._carregar(uid, tipo)
+        with self._lock:
+            if len(self._estados) >= self.max_usuarios:
+                self._estados.pop(next(iter(self._estados)))
+            self._estados[chave] = estado
+        return estado
+
+    def _estados_do_usuario(self, uid: str, categoria: str | None = None) -> list[EstadoGrupos]:
+        return [
+            estado for (u, tipo), estado in self._estados.items()
+            if u == uid and (tipo == "todos" or categoria is None or tipo == categoria)
+        ]
+
+    # Interface de agregador da FilaCliques: aplica o clique assim que é enfileirado
+    def registrar(self, link_id: str, log: dict):
+        uid, slug = log.get("uid"), log.get("slug")
+        if not uid or not slug:
+            return
+        with self._lock:
+            for estado in self._estados_do_usuario(uid, log.get("categoria")):
+                grupo = estado.grupos.get(slug)
+                if grupo:
+                    estado.aplicar(slug, cliques=grupo["cliques"] + 1)
+
+    def descarregar(self, db):
+        pass
+
+    def registrar_entradas(self, uid: str, slug: str, entradas: int):
+        with self._lock:
+            for estado in self._estados_do_usuario(uid):
+                estado.aplicar(slug, entradas=entradas)
+
+    def invalidar(self, uid: str):
+        with self._lock:
+            for chave in [c for c in self._estados if c[0] == uid]:
+                del self._estados[chave]
+
+    def painel(self, uid: str, tipo: str, data_limite: datetime | None = None) -> dict:
+        """Lista, resumo, rankings e recomendações prontos para desempenho_de_grupos.html."""
+        estado = self.obter(uid, tipo)
+        with self._lock:
+            grupos = [g for g in estado.grupos.values() if criado_na_janela(g, data_limite)]
+
+            if data_limite:
+                # Período filtrado: top-k só sobre os grupos da janela
+                rankings = {
+                    m: heapq.nlargest(self.k, grupos, key=lambda g, m=m: g[m]) for m in METRICAS
+                }
+            else:
+                rankings = {m: estado.ranking(m) for m in METRICAS}
+
+            recomendacoes = [r for g in grupos for r in estado.recomendacoes.get(g["slug"], [])]
+
+        total_cliques = sum(g["cliques"] for g in grupos)
+        total_grupos = len(grupos)
+        return {
+            "grupos": grupos,
+            "resumo": {
+                "total_cliques": total_cliques,
+                "total_grupos": total_grupos,
+                "media_cliques": round(total_cliques / total_grupos, 2) if total_grupos else 0,
+                "mais_clicado": rankings["cliques"][0]["slug"] if rankings["cliques"] else "Nenhum"
+            },
+            "ranking_cliques": rankings["cliques"],
+            "ranking_conversao": rankings["conversao"],
+            "ranking_entradas": rankings["entradas"],
+            "recomendacoes": recomendacoes
+        }
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+
+import indice_slugs
+from consultas import MAX_OPERACOES_BATCH, abandonado, gravar_em_batches, reivindicar
+
+# migracoes/categorias: estado do job de recategorização
+#   { status, iniciado_em, atualizado_em, lidos, alterados, duracao, docs_por_segundo,
+#     particoes: {"faixa_0": {inicio, fim, cursor, concluida, lidos, alterados}, ...} }
+DOC_JOB = ("migracoes", "categorias")
+# Ids automáticos do Firestore: 20 caracteres deste alfabeto, distribuídos uniformemente
+ALFABETO_IDS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+# Categorias que não vêm da URL: escolhidas pelo usuário e nunca recalculadas
+CATEGORIAS_FIXAS = ("contador",)
+
+
+def limites_particoes(quantidade: int) -> list[tuple[str | None, str | None]]:
+    """Divide o espaço de ids em faixas [inicio, fim) pelo primeiro caractere."""
+    quantidade = max(1, min(quantidade, len(ALFABETO_IDS)))
+    cortes = [ALFABETO_IDS[len(ALFABETO_IDS) * i // quantidade] for i in range(1, quantidade)]
+    inicios = [None] + cortes
+    fins = cortes + [None]
+    return list(zip(inicios, fins))
+
+
+class Recategorizacao:
+    """
+    Recalcula a categoria dos links a partir da URL (menos as escolhidas pelo
+    usuário: categoria_manual ou contador). A coleção é
+    dividida em faixas de id processadas em paralelo, página a página, com
+    batches de até 500 operações; o cursor de cada faixa é gravado após cada
+    página, então um job interrompido continua de onde parou.
+    """
+
+    def __init__(self, db, categorizar, ao_alterar=None, particoes: int = 8, tamanho_pagina: int = 500):
+        self.db = db
+        self.categorizar = categorizar
+        self.ao_alterar = ao_alterar
+        self.particoes = particoes
+        self.tamanho_pagina = tamanho_pagina
+
+    def _ref(self):
+        return self.db.collection(DOC_JOB[0]).document(DOC_JOB[1])
+
+    def estado(self) -> dict:
+        doc = self._ref().get()
+        return doc.to_dict() if doc.exists else {}
+
+    def _reivindicar(self) -> dict | None:
+        """Inicia um job novo ou retoma um interrompido; None se outro worker já está rodando."""
+        ref = self._ref()
+
+        def decidir(transacao, job, agora):
+            if job.get("status") == "executando":
+                if not abandonado(job, agora=agora):
+                    return None
+                # Abandonado: retoma as faixas do ponto salvo
+                transacao.update(ref, {"atualizado_em": agora})
+                return job
+
+            job = {
+                "status": "executando",
+                "iniciado_em": agora,
+                "atualizado_em": agora,
+                "lidos": 0,
+                "alterados": 0,
+                "particoes": {
+                    f"faixa_{i}": {"inicio": inicio, "fim": fim, "cursor": None, "concluida": False,
+                                   "lidos": 0, "alterados": 0}
+                    for i, (inicio, fim) in enumerate(limites_particoes(self.particoes))
+                }
+            }
+            transacao.set(ref, job)
+            return job
+
+        return reivindicar(self.db, ref, decidir)
+
+    def _processar_particao(self, chave: str, particao: dict) -> tuple[int, int]:
+        colecao = self.db.collection(indice_slugs.COLECAO_LINKS)
+        campos = ["slug", "url_destino", "categoria", "categoria_manual", "modo", "uid"]
+        cursor = particao.get("cursor")
+        lidos, alterados = particao.get("lidos", 0), particao.get("alterados", 0)
+
+        while True:
+            query = colecao.order_by(firestore.FieldPath.document_id()).select(campos).limit(self.tamanho_pagina)
+            if cursor or particao.get("inicio"):
+                operador = ">" if cursor else ">="
+                query = query.where(firestore.FieldPath.document_id(), operador,
+                                    colecao.document(cursor or particao["inicio"]))
+            if particao.get("fim"):
+                query = query.where(firestore.FieldPath.document_id(), "<", colecao.document(particao["fim"]))
+            pagina = list(query.stream())
+            if not pagina:
+                break
+
+            mudancas = []
+            indexados = indice_slugs.donos(self.db, [d.to_dict().get("slug") for d in pagina])
+            for doc in pagina:
+                dados = doc.to_dict()
+                if dados.get("categoria_manual") or dados.get("categoria") in CATEGORIAS_FIXAS:
+                    continue
+                nova_categoria = self.categorizar(dados.get("url_destino", ""))
+                if dados.get("categoria") != nova_categoria:
+                    mudancas.append((doc, {**dados, "categoria": nova_categoria}))
+
+            def aplicar(batch, mudanca):
+                doc, dados = mudanca
+                batch.update(doc.reference, {"categoria": dados["categoria"]})
+                indice_slugs.sincronizar(batch, self.db, doc.id, dados, indexados)
+
+            # Até 2 operações por link (link + slugs/{slug})
+            gravar_em_batches(self.db, mudancas, aplicar, tamanho=MAX_OPERACOES_BATCH // 2, propagar_erro=True)
+            alterados += len(mudancas)
+            slugs = [dados.get("slug") for _, dados in mudancas]
+            if self.ao_alterar and slugs:
+                self.ao_alterar(slugs)
+
+            cursor = pagina[-1].id
+            lidos += len(pagina)
+            # Checkpoint da faixa: só depois que os batches da página foram gravados
+            self._ref().update({
+                f"particoes.{chave}.cursor": cursor,
+                f"particoes.{chave}.lidos": lidos,
+                f"particoes.{chave}.alterados": alterados,
+                "atualizado_em": datetime.now(timezone.utc)
+            })
+
+        self._ref().update({f"particoes.{chave}.concluida": True})
+        return lidos, alterados
+
+    def executar(self) -> dict | None:
+        """Roda (ou retoma) o job. Retorna o relatório, ou None se já está rodando em outro lugar."""
+        job = self._reivindicar()
+        if job is None:
+            print("🔧 Recategorização já em andamento, ignorando")
+            return None
+
+        inicio = time.monotonic()
+        lidos_antes = sum(p.get("lidos", 0) for p in job["particoes"].values())
+        pendentes = {k: p for k, p in job["particoes"].items() if not p.get("concluida")}
+        totais = {k: (p.get("lidos", 0), p.get("alterados", 0)) for k, p in job["particoes"].items()}
+
+        erros = []
+        with ThreadPoolExecutor(max_workers=max(1, len(pendentes)), thread_name_prefix="categorias") as executor:
+            futuros = {k: executor.submit(self._processar_particao, k, p) for k, p in pendentes.items()}
+            for chave, futuro in futuros.items():
+                try:
+                    totais[chave] = futuro.result()
+                except Exception as e:
+                    erros.append(chave)
+                    print(f"❌ Erro na faixa {chave} da recategorização: {e}")
+
+        duracao = time.monotonic() - inicio
+        lidos = sum(t[0] for t in totais.values())
+        relatorio = {
+            "status": "erro" if erros else "concluido",
+            "lidos": lidos,
+            "alterados": sum(t[1] for t in totais.values()),
+            "duracao": round(duracao, 2),
+            "docs_por_segundo": round((lidos - lidos_antes) / duracao, 1) if duracao > 0 else 0,
+            "atualizado_em": datetime.now(timezone.utc)
+        }
+        if not erros:
+            # Com erro o status fica "executando" e o job é retomado após TEMPO_ABANDONO
+            self._ref().update(relatorio)
+        print(f"🔧 Recategorização: {relatorio['lidos']} lidos, {relatorio['alterados']} alterados, "
+              f"{relatorio['docs_por_segundo']} docs/s")
+        return relatorio
+
+    def iniciar_em_segundo_plano(self) -> dict:
+        """Dispara executar() numa thread e devolve o estado atual do job."""
+        threading.Thread(target=self.executar, daemon=True, name="recategorizacao").start()
+        return self.estado()
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import os
+import time
+from datetime import datetime
+
+from flask import render_template, request, redirect
+
+import indice_slugs
+import rollups_cliques
+from cache import CacheLRU
+from fila_cliques import FilaCliques
+from snapshot_painel import AgregadorSnapshot
+
+
+class Redirecionador:
+    """
+    Rotas /r/<slug> e /registrar-clique-grupo/<slug> com o cache de slugs e a
+    fila de cliques. Usado pelo app completo (app.py) e pelo entry point
+    enxuto de redirecionamento (redirect_app.py).
+    """
+
+    def __init__(self, db, agregadores: list | None = None):
+        self.db = db
+
+        # ⚡ Cache de slugs (LRU com TTL, em memória de cada worker)
+        self.cache = CacheLRU(
+            tamanho_max=int(os.getenv("CACHE_SLUGS_TAMANHO", "10000")),
+            ttl=float(os.getenv("CACHE_SLUGS_TTL", "60"))
+        )
+
+        # 📨 Fila de cliques gravada em lotes por uma thread em segundo plano
+        # (os rollups por dia/hora/slug e o snapshot do painel são atualizados no mesmo ciclo)
+        self.rollups = rollups_cliques.AgregadorRollups()
+        self.fila = FilaCliques(
+            db,
+            tamanho_max=int(os.getenv("FILA_CLIQUES_TAMANHO", "10000")),
+            tamanho_lote=int(os.getenv("FILA_CLIQUES_LOTE", "500")),
+            intervalo=float(os.getenv("FILA_CLIQUES_INTERVALO", "2")),
+            intervalo_contadores=float(os.getenv("FILA_CLIQUES_INTERVALO_CONTADORES", "5")),
+            agregadores=[self.rollups, AgregadorSnapshot(), *(agregadores or [])]
+        )
+
+        # Enquanto a migração do índice de slugs não termina, links antigos ainda são buscados por query
+        self._migracao_slugs = {"concluida": False, "verificado_em": 0.0}
+
+    def slugs_migrados(self) -> bool:
+        migracao = self._migracao_slugs
+        if not migracao["concluida"] and time.time() - migracao["verificado_em"] > 60:
+            migracao["verificado_em"] = time.time()
+            try:
+                migracao["concluida"] = indice_slugs.migracao_concluida(self.db)
+            except Exception as e:
+                print(f"Erro ao verificar migração de slugs: {e}")
+        return migracao["concluida"]
+
+    def marcar_slugs_migrados(self):
+        self._migracao_slugs["concluida"] = True
+
+    def buscar_link_legado(self, slug, uid=None):
+        query = self.db.collection("links_encurtados").where("slug", "==", slug)
+        if uid:
+            query = query.where("uid", "==", uid)
+        return next(query.limit(1).stream(), None)
+
+    def obter_link_por_slug(self, slug):
+        """
+        Retorna os dados de redirecionamento do slug:
+          { link_id, url_destino, modo, categoria, uid }
+        Consulta o cache local, depois slugs/{slug}. Retorna None se não existir.
+        """
+        link = self.cache.obter(slug)
+        if link is not None:
+            return link
+
+        link = indice_slugs.obter(self.db, slug)
+        if link is None and not self.slugs_migrados():
+            doc = self.buscar_link_legado(slug)
+            if doc:
+                link = indice_slugs.dados_indice(doc.id, doc.to_dict())
+        if link is None:
+            return None
+
+        self.cache.definir(slug, link)
+        return link
+
+    def registrar_rotas(self, app):
+        app.add_url_rule("/r/<slug>", "redirecionar", self.redirecionar)
+        # ✅ ROTA PARA REGISTRAR CLIQUES REAIS (botão da página camuflada)
+        app.add_url_rule("/registrar-clique-grupo/<slug>", "registrar_clique_grupo", self.registrar_clique_grupo)
+
+    def redirecionar(self, slug):
+        link = self.obter_link_por_slug(slug)
+
+        if link:
+            modo = link["modo"]
+            categoria = link["categoria"]
+            destino = link["url_destino"]
+
+            self.fila.enfileirar(link["link_id"], {
+                "link_id": link["link_id"],
+                "slug": slug,
+                "uid": link["uid"],
+                "categoria": categoria,
+                "data": datetime.now(),
+                "ip": request.remote_addr,
+                "user_agent": request.headers.get("User-Agent")
+            })
+
+            if categoria == "contador":
+                return render_template("contador_clicks.html", slug=slug)
+
+            if modo == "camuflado":
+                return render_template("intermediario.html", link_grupo=destino, slug=slug)
+
+            return redirect(destino)
+
+        return "Link não encontrado", 404
+
+    def registrar_clique_grupo(self, slug):
+        link = self.obter_link_por_slug(slug)
+        if not link:
+            return "Link não encontrado", 404
+
+        self.fila.enfileirar(link["link_id"], {
+            "link_id": link["link_id"],
+            "slug": slug,
+            "uid": link["uid"],
+            "categoria": link["categoria"],
+            "data": datetime.now(),
+            "ip": request.remote_addr,
+            "user_agent": request.headers.get("User-Agent"),
+            "tipo": "botao_grupo"
+        })
+        return "", 204
+
+    def estatisticas(self) -> dict:
+        return {
+            "cache_slugs": self.cache.estatisticas(),
+            "fila_cliques": self.fila.estatisticas(),
+            "rollups_pendentes": len(self.rollups)
+        }
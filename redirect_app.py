@@ -0,0 +1,16 @@
+# 🚀 Entry point enxuto só para o redirecionamento: gunicorn redirect_app:app
+# Sem schedulers e sem as dependências das demais rotas, para escalar os
+# workers de /r/<slug> com boot rápido e pouca memória.
+from __future__ import annotations
+
+from flask import Flask
+
+from firebase_app import inicializar_firebase
+from redirecionamento import Redirecionador
+
+db = inicializar_firebase()
+
+app = Flask(__name__)
+
+redirecionador = Redirecionador(db)
+redirecionador.registrar_rotas(app)
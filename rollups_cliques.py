@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+from firebase_admin import firestore
+from pytz import timezone
+
+from consultas import gravar_em_batches, somar
+
+# rollups_cliques/{uid}/dias/{AAAA-MM-DD}:
+#   { uid, dia, mes, total, horas: {"0".."23": n}, slugs: {slug: n} }
+# Dia e hora no fuso de São Paulo, o mesmo usado nos gráficos.
+COLECAO_ROLLUPS = "rollups_cliques"
+FUSO = timezone("America/Sao_Paulo")
+
+
+def para_fuso(data) -> datetime:
+    if isinstance(data, str):
+        data = datetime.fromisoformat(data.replace("Z", "+00:00"))
+    return data.astimezone(FUSO)
+
+
+def dias_ref(db, uid: str):
+    return db.collection(COLECAO_ROLLUPS).document(uid).collection("dias")
+
+
+class AgregadorRollups:
+    """
+    Acumula os cliques por uid/dia/hora/slug em memória e grava um
+    set(merge) com Increment por documento de dia a cada descarregamento.
+    Plugado na FilaCliques, roda junto com o ContadorCliques.
+    """
+
+    def __init__(self):
+        self._deltas: dict = {}
+        self._lock = threading.Lock()
+        self.documentos_gravados = 0
+
+    def registrar(self, link_id: str, log: dict):
+        uid = log.get("uid")
+        if not uid or not log.get("data"):
+            return
+        dt = para_fuso(log["data"])
+        self.somar(uid, dt.date().isoformat(), dt.hour, log.get("slug", ""))
+
+    def somar(self, uid: str, dia: str, hora: int, slug: str, quantidade: int = 1):
+        with self._lock:
+            delta = self._deltas.setdefault((uid, dia), {"total": 0, "horas": Counter(), "slugs": Counter()})
+            delta["total"] += quantidade
+            delta["horas"][str(hora)] += quantidade
+            if slug:
+                delta["slugs"][slug] += quantidade
+
+    def retirar(self) -> dict:
+        with self._lock:
+            deltas, self._deltas = self._deltas, {}
+        return deltas
+
+    def devolver(self, deltas):
+        """Soma de volta ao acumulador deltas que não foram gravados."""
+        with self._lock:
+            for chave, delta in deltas:
+                atual = self._deltas.setdefault(chave, {"total": 0, "horas": Counter(), "slugs": Counter()})
+                atual["total"] += delta["total"]
+                atual["horas"].update(delta["horas"])
+                atual["slugs"].update(delta["slugs"])
+
+    def descarregar(self, db):
+        deltas = list(self.retirar().items())
+        falhas = gravar_em_batches(db, deltas, lambda batch, item: batch.set(*incremento(db, *item), merge=True))
+        self.documentos_gravados += len(deltas) - len(falhas)
+        # Tenta de novo no próximo descarregamento
+        self.devolver(falhas)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._deltas)
+
+
+def incremento(db, chave: tuple, delta: dict) -> tuple:
+    """(ref, dados) do set(merge) que soma `delta` ao documento de dia (uid, dia)."""
+    uid, dia = chave
+    return dias_ref(db, uid).document(dia), {
+        "uid": uid,
+        "dia": dia,
+        "mes": dia[:7],
+        "total": firestore.Increment(delta["total"]),
+        "horas": {h: firestore.Increment(n) for h, n in delta["horas"].items()},
+        "slugs": {s: firestore.Increment(n) for s, n in delta["slugs"].items()}
+    }
+
+
+def cliques_por_hora(db, uid: str, desde: datetime | None = None) -> list[int]:
+    """Histograma de 24 posições somando os documentos de dia a partir de `desde`."""
+    query = dias_ref(db, uid)
+    if desde:
+        query = query.where("dia", ">=", para_fuso(desde).date().isoformat())
+    horas = [0] * 24
+    for doc in query.select(["horas"]).stream():
+        for hora, quantidade in (doc.to_dict().get("horas") or {}).items():
+            horas[int(hora)] += int(quantidade)
+    return horas
+
+
+def total_mes(db, uid: str, mes: str) -> int:
+    """Total de cliques do mês (AAAA-MM): sum() sobre no máximo 31 documentos de dia."""
+    return int(somar(dias_ref(db, uid).where("mes", "==", mes), "total"))
+
+
+def logs_na_janela(db, uid: str | None, inicio: datetime, fim: datetime | None = None,
+                   campos: list[str] | None = None):
+    """
+    Query de logs_cliques limitada à janela [inicio, fim) e projetada só nos
+    campos pedidos (sem ip/user_agent). Com uid usa o índice composto
+    uid + data de firestore.indexes.json.
+    """
+    query = db.collection("logs_cliques")
+    if uid:
+        query = query.where("uid", "==", uid)
+    query = query.where("data", ">=", inicio)
+    if fim:
+        query = query.where("data", "<", fim)
+    return query.select(campos or ["data"])
+
+
+def reconstruir(db, dias: int = 30, uid: str | None = None) -> int:
+    """
+    Recalcula os rollups dos últimos `dias` a partir de logs_cliques e
+    sobrescreve os documentos de dia. Serve para o backfill inicial e para
+    corrigir dias antigos; evite rodar sobre o dia corrente com tráfego.
+    """
+    inicio = datetime.now(FUSO).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=dias - 1)
+    # Cada log é dobrado no agregador assim que chega do stream (nada é acumulado em lista)
+    agregador = AgregadorRollups()
+    for doc in logs_na_janela(db, uid, inicio, campos=["uid", "slug", "data"]).stream():
+        try:
+            agregador.registrar(doc.id, doc.to_dict())
+        except Exception as e:
+            print(f"[ROLLUP] log {doc.id} ignorado: {e}")
+
+    deltas = list(agregador.retirar().items())
+
+    def _sobrescrever(batch, item):
+        (uid_dia, dia), delta = item
+        batch.set(dias_ref(db, uid_dia).document(dia), {
+            "uid": uid_dia,
+            "dia": dia,
+            "mes": dia[:7],
+            "total": delta["total"],
+            "horas": dict(delta["horas"]),
+            "slugs": dict(delta["slugs"])
+        })
+
+    gravar_em_batches(db, deltas, _sobrescrever, propagar_erro=True)
+    return len(deltas)
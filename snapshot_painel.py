@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from firebase_admin import firestore
+
+from cache import CacheLRU
+from consultas import gravar_em_batches
+from rollups_cliques import FUSO
+
+# painel_snapshot/{uid}: números do dashboard materializados
+#   { dia, mes, links_hoje, cliques_mes, produto_mais_clicado, grupo_mais_clicado,
+#     links_recentes, atualizado_em, acessado_em }
+COLECAO_SNAPSHOT = "painel_snapshot"
+
+
+def chaves_atuais() -> tuple[str, str]:
+    """(dia, mes) a que o snapshot se refere; se mudarem, ele é recalculado."""
+    return datetime.today().date().isoformat(), datetime.now(FUSO).strftime("%Y-%m")
+
+
+class AgregadorSnapshot:
+    """
+    Soma os cliques por uid e aplica Increment em cliques_mes do snapshot.
+    Plugado na FilaCliques, igual aos rollups.
+    """
+
+    def __init__(self):
+        self._pendentes: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def registrar(self, link_id: str, log: dict):
+        if log.get("uid"):
+            with self._lock:
+                self._pendentes[log["uid"]] += 1
+
+    def descarregar(self, db):
+        with self._lock:
+            pendentes, self._pendentes = self._pendentes, Counter()
+        falhas = gravar_em_batches(db, list(pendentes.items()), lambda batch, item: batch.set(
+            db.collection(COLECAO_SNAPSHOT).document(item[0]),
+            {"cliques_mes": firestore.Increment(item[1])}, merge=True
+        ))
+        # Volta para o acumulador e tenta de novo no próximo descarregamento
+        with self._lock:
+            self._pendentes.update(dict(falhas))
+
+
+class SnapshotsPainel:
+    """
+    Snapshot do dashboard por uid, em memória (TTL curto) e no Firestore.
+    `calcular(uid)` recalcula tudo a partir das coleções de origem e só é
+    chamado quando o snapshot não existe, virou o dia/mês ou no agendador.
+    Se ele devolver parcial=True (alguma consulta caiu no valor padrão), o
+    resultado é exibido mas não é gravado nem guardado no cache.
+    """
+
+    def __init__(self, db, calcular, ttl: float = 30.0):
+        self.db = db
+        self.calcular = calcular
+        self.cache = CacheLRU(tamanho_max=5000, ttl=ttl)
+        self._ultimo_acesso_gravado: dict = {}
+
+    def _ref(self, uid):
+        return self.db.collection(COLECAO_SNAPSHOT).document(uid)
+
+    def obter(self, uid: str) -> dict:
+        dia, mes = chaves_atuais()
+        snapshot = self.cache.obter(uid)
+        if snapshot and snapshot.get("dia") == dia and snapshot.get("mes") == mes:
+            return snapshot
+
+        doc = self._ref(uid).get()
+        snapshot = doc.to_dict() if doc.exists else None
+        if not snapshot or snapshot.get("dia") != dia or snapshot.get("mes") != mes:
+            return self.reconstruir(uid, acesso=True)
+
+        self._registrar_acesso(uid)
+        self.cache.definir(uid, snapshot)
+        return snapshot
+
+    def reconstruir(self, uid: str, acesso: bool = False) -> dict:
+        dia, mes = chaves_atuais()
+        snapshot = {**self.calcular(uid), "dia": dia, "mes": mes, "atualizado_em": datetime.now()}
+        if snapshot.pop("parcial", False):
+            print(f"⚠️ Snapshot do painel de {uid} parcial, não gravado")
+            return snapshot
+        if acesso:
+            snapshot["acessado_em"] = snapshot["atualizado_em"]
+            self._ultimo_acesso_gravado[uid] = time.monotonic()
+        self._ref(uid).set(snapshot, merge=True)
+        self.cache.definir(uid, snapshot)
+        return snapshot
+
+    def _registrar_acesso(self, uid: str):
+        # acessado_em decide quem entra na reconstrução agendada; grava no máximo 1x por hora
+        if time.monotonic() - self._ultimo_acesso_gravado.get(uid, 0) < 3600:
+            return
+        self._ultimo_acesso_gravado[uid] = time.monotonic()
+        try:
+            self._ref(uid).update({"acessado_em": datetime.now()})
+        except Exception as e:
+            print(f"Erro ao registrar acesso ao painel de {uid}: {e}")
+
+    def _atualizar(self, uid: str, aplicar):
+        """Aplica `aplicar(snapshot) -> dict | None` ao snapshot numa transação."""
+        ref = self._ref(uid)
+
+        @firestore.transactional
+        def _executar(transacao):
+            doc = ref.get(transaction=transacao)
+            if not doc.exists:
+                return
+            alteracoes = aplicar(doc.to_dict())
+            if alteracoes:
+                transacao.update(ref, alteracoes)
+
+        try:
+            _executar(self.db.transaction())
+        except Exception as e:
+            print(f"Erro ao atualizar snapshot do painel de {uid}: {e}")
+        self.cache.invalidar(uid)
+
+    def registrar_link_criado(self, uid: str, link: dict, quantidade: int = 1):
+        dia, _ = chaves_atuais()
+
+        def aplicar(snapshot):
+            if snapshot.get("dia") != dia:
+                return None
+            recentes = [r for r in snapshot.get("links_recentes", []) if r.get("slug") != link.get("slug")]
+            return {
+                "links_hoje": snapshot.get("links_hoje", 0) + quantidade,
+                "links_recentes": ([{
+                    "slug": link.get("slug"),
+                    "titulo": link.get("titulo", "Sem título"),
+                    "cliques": link.get("cliques", 0),
+                    "categoria": link.get("categoria", "indefinido")
+                }] + recentes)[:4]
+            }
+
+        self._atualizar(uid, aplicar)
+
+    def registrar_link_editado(self, uid: str, slug_antigo: str, link: dict):
+        def aplicar(snapshot):
+            recentes = snapshot.get("links_recentes", [])
+            if not any(r.get("slug") == slug_antigo for r in recentes):
+                return None
+            return {"links_recentes": [
+                {**r, "slug": link.get("slug"), "categoria": link.get("categoria", r.get("categoria"))}
+                if r.get("slug") == slug_antigo else r
+                for r in recentes
+            ]}
+
+        self._atualizar(uid, aplicar)
+
+    def invalidar(self, uid: str):
+        """Força o recálculo na próxima leitura (ex.: link excluído)."""
+        self.cache.invalidar(uid)
+        try:
+            self._ref(uid).set({"dia": None}, merge=True)
+        except Exception as e:
+            print(f"Erro ao invalidar snapshot do painel de {uid}: {e}")
+
+    def reconstruir_ativos(self, horas: int = 24) -> int:
+        """Recalcula os snapshots acessados nas últimas `horas` (rodado pelo agendador)."""
+        limite = datetime.now() - timedelta(hours=horas)
+        total = 0
+        for doc in self.db.collection(COLECAO_SNAPSHOT).where("acessado_em", ">=", limite).select([]).stream():
+            try:
+                self.reconstruir(doc.id)
+                total += 1
+            except Exception as e:
+                print(f"Erro ao reconstruir snapshot do painel de {doc.id}: {e}")
+        return total
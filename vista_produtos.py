@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+from datetime import datetime
+
+import catalogo_produtos
+from cache import CacheLRU
+from indice_busca import IndiceInvertido
+from rollups_cliques import FUSO
+
+
+def formatar_data(atualizado_em) -> str:
+    try:
+        dt = datetime.fromisoformat(atualizado_em.replace("Z", "+00:00"))
+        return dt.astimezone(FUSO).strftime("%Y/%m/%d às %H:%M")
+    except Exception:
+        return "Data inválida"
+
+
+class VistaProdutos:
+    """
+    Página /produtos materializada por uid: produtos já ordenados do mais
+    recente, datas já formatadas, lojas e palavras-chave já calculadas e o
+    índice invertido (título + loja, sem acentos) usado no filtro.
+    Fica em memória e é refeita quando a versao_catalogo do usuário muda
+    (catalogo_produtos incrementa a versão a cada escrita), então uma página
+    custa uma leitura e um fatiamento de lista.
+    """
+
+    def __init__(self, db, tamanho_max: int = 2000, ttl: float = 600.0):
+        self.db = db
+        self.cache = CacheLRU(tamanho_max=tamanho_max, ttl=ttl)
+
+    def _montar(self, uid: str, versao) -> dict:
+        produtos = []
+        for p in catalogo_produtos.listar(self.db, uid):
+            produtos.append({**p, "atualizado_em": formatar_data(p["atualizado_em"]) if p.get("atualizado_em") else None})
+
+        resultados, palavras = [], set()
+        termos = catalogo_produtos.termos_ref(self.db, uid).select(["termo", "tipo", "atualizado_em", "quantidade"])
+        for doc in termos.stream():
+            dados = doc.to_dict()
+            if dados.get("termo") and dados.get("quantidade"):
+                palavras.add(dados["termo"].lower())
+            resultados.append({
+                "termo": dados.get("termo"),
+                "tipo": dados.get("tipo"),
+                "atualizado_em": dados.get("atualizado_em"),
+                "quantidade": dados.get("quantidade", 0)
+            })
+
+        por_loja = {}
+        for posicao, p in enumerate(produtos):
+            if p.get("loja"):
+                por_loja.setdefault(p["loja"], []).append(posicao)
+
+        return {
+            "versao": versao,
+            "produtos": produtos,
+            "indice": IndiceInvertido([f"{p.get('titulo') or ''} {p.get('loja') or ''}" for p in produtos]),
+            "por_loja": por_loja,
+            "resultados": resultados,
+            "lojas_unicas": sorted({p["loja"] for p in produtos if p.get("loja")}),
+            "palavras_disponiveis": sorted(palavras)
+        }
+
+    def obter(self, uid: str) -> dict:
+        catalogo_produtos.garantir_migrado(self.db, uid)
+        versao = catalogo_produtos.versao(self.db, uid)
+        vista = self.cache.obter(uid)
+        if vista is not None and vista["versao"] == versao:
+            return vista
+        vista = self._montar(uid, versao)
+        self.cache.definir(uid, vista)
+        return vista
+
+    @staticmethod
+    def filtrar(vista: dict, loja: str = "", consulta: str = "") -> list[dict]:
+        """Produtos da loja e/ou com todas as palavras da consulta, mantendo a ordem da vista."""
+        if not loja and not consulta:
+            return vista["produtos"]
+        posicoes = vista["indice"].buscar(consulta) if consulta else None
+        if loja:
+            da_loja = vista["por_loja"].get(loja, [])
+            posicoes = da_loja if posicoes is None else sorted(set(posicoes).intersection(da_loja))
+        if posicoes is None:
+            return vista["produtos"]
+        return [vista["produtos"][i] for i in posicoes]
+
+    def invalidar(self, uid: str):
+        self.cache.invalidar(uid)